@@ -0,0 +1,302 @@
+"""In-process load driver for the API, used by the benchmark_api command.
+
+Requests go through the real WSGI application, the whole middleware stack
+included, without a network or server in between.
+"""
+import base64
+import io
+import json
+import math
+import random
+import sys
+import time
+from urllib.parse import quote
+
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.models import Count
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Cart, Favorite, Ingredient, Recipe, Tag
+from users.models import CustomUser, Subscribe
+
+
+def percentile(ordered, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class WSGIClient:
+
+    def __init__(self, application=None):
+        self.application = application or get_wsgi_application()
+
+    def request(self, method, path, token=None, data=None):
+        """Run one request, return (status, response body, queries)."""
+        path, _, query = path.partition('?')
+        body = b'' if data is None else json.dumps(data).encode()
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if token is not None:
+            environ['HTTP_AUTHORIZATION'] = f'Token {token}'
+        statuses = []
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(int(status.split()[0]))
+
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            result = self.application(environ, start_response)
+            try:
+                content = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        return statuses[0], content, queries.count
+
+
+def png_data_uri():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), '#49B64E').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class Fixture:
+    """Ids the scenarios pick from, taken from the current database."""
+
+    def __init__(self, seed=0, write_ingredients=50):
+        self.rng = random.Random(seed)
+        self.viewer = CustomUser.objects.annotate(
+            follows=Count('follower')
+        ).order_by('-follows', 'id').first()
+        if self.viewer is None:
+            raise ValueError('The database has no users.')
+        self.token = Token.objects.get_or_create(user=self.viewer)[0].key
+        self.recipe_ids = list(
+            Recipe.objects.order_by('?').values_list('id', flat=True)[:1000]
+        )
+        if not self.recipe_ids:
+            raise ValueError('The database has no recipes.')
+        self.tag_ids = list(Tag.objects.values_list('id', flat=True))
+        self.tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        self.name_prefixes = [
+            name[:3] for name in Ingredient.objects.order_by('?').values_list(
+                'name', flat=True
+            )[:200]
+        ]
+        favorite_ids = set(Favorite.objects.filter(
+            owner=self.viewer
+        ).values_list('recipe_id', flat=True))
+        cart_ids = set(Cart.objects.filter(
+            owner=self.viewer
+        ).values_list('recipe_id', flat=True))
+        self.unfavorited_ids = [
+            pk for pk in self.recipe_ids if pk not in favorite_ids
+        ]
+        self.not_in_cart_ids = [
+            pk for pk in self.recipe_ids if pk not in cart_ids
+        ]
+        following_ids = set(Subscribe.objects.filter(
+            user=self.viewer
+        ).values_list('following_id', flat=True))
+        self.unfollowed_ids = [
+            pk for pk in CustomUser.objects.exclude(
+                id__in=following_ids
+            ).exclude(id=self.viewer.id).values_list('id', flat=True)[:1000]
+        ]
+        self.write_ingredient_ids = list(
+            Ingredient.objects.order_by('?').values_list(
+                'id', flat=True
+            )[:write_ingredients]
+        )
+        self.image = png_data_uri()
+        self.created_ids = []
+
+    def pick(self, items):
+        return self.rng.choice(items)
+
+    def pantry(self, size=10):
+        return ','.join(map(str, self.rng.sample(
+            self.write_ingredient_ids,
+            min(size, len(self.write_ingredient_ids))
+        )))
+
+    def recipe_payload(self, number, shift=0):
+        return {
+            'name': f'Бенчмарк {number}',
+            'text': 'Рецепт для нагрузочного теста.',
+            'cooking_time': 10,
+            'image': self.image,
+            'tags': self.tag_ids[:1],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10 + (index + shift) % 7}
+                for index, ingredient_id
+                in enumerate(self.write_ingredient_ids)
+            ],
+        }
+
+
+def toggle(ids, path):
+    """POST on even iterations, DELETE of the same object on odd ones."""
+    def request(fixture, number):
+        target = ids(fixture)[(number // 2) % len(ids(fixture))]
+        method = 'POST' if number % 2 == 0 else 'DELETE'
+        return method, path.format(target), fixture.token, None
+    return request
+
+
+def create_recipe(fixture, number):
+    return 'POST', '/api/recipes/', fixture.token, fixture.recipe_payload(
+        number
+    )
+
+
+def update_recipe(fixture, number):
+    recipe_id = fixture.created_ids[number % len(fixture.created_ids)]
+    return 'PATCH', f'/api/recipes/{recipe_id}/', fixture.token, (
+        fixture.recipe_payload(number, shift=number + 1)
+    )
+
+
+def delete_recipe(fixture, number):
+    return (
+        'DELETE',
+        f'/api/recipes/{fixture.created_ids.pop()}/',
+        fixture.token,
+        None
+    )
+
+
+READ_SCENARIOS = {
+    'recipe_list': lambda f, n: (
+        'GET', f'/api/recipes/?page={n % 5 + 1}', None, None
+    ),
+    'recipe_list_auth': lambda f, n: (
+        'GET', f'/api/recipes/?page={n % 5 + 1}', f.token, None
+    ),
+    'recipe_list_tags': lambda f, n: (
+        'GET', f'/api/recipes/?tags={f.pick(f.tag_slugs)}&page={n % 5 + 1}',
+        f.token, None
+    ),
+    'recipe_list_favorited': lambda f, n: (
+        'GET', '/api/recipes/?is_favorited=1', f.token, None
+    ),
+    'recipe_list_popular': lambda f, n: (
+        'GET', '/api/recipes/?ordering=popular', f.token, None
+    ),
+    'recipe_match': lambda f, n: (
+        'GET', f'/api/recipes/match/?ingredients={f.pantry()}', f.token, None
+    ),
+    'recipe_detail': lambda f, n: (
+        'GET', f'/api/recipes/{f.pick(f.recipe_ids)}/', f.token, None
+    ),
+    'recipe_similar': lambda f, n: (
+        'GET', f'/api/recipes/{f.pick(f.recipe_ids)}/similar/', f.token, None
+    ),
+    'subscriptions': lambda f, n: (
+        'GET', f'/api/users/subscriptions/?recipes_limit=3&page={n % 3 + 1}',
+        f.token, None
+    ),
+    'user_feed': lambda f, n: (
+        'GET', '/api/users/feed/?limit=10', f.token, None
+    ),
+    'download_shopping_cart': lambda f, n: (
+        'GET', '/api/recipes/download_shopping_cart/', f.token, None
+    ),
+    'ingredient_search': lambda f, n: (
+        'GET', f'/api/ingredients/?name={quote(f.pick(f.name_prefixes))}',
+        None, None
+    ),
+}
+
+TOGGLE_SCENARIOS = {
+    'favorite_toggle': toggle(
+        lambda f: f.unfavorited_ids, '/api/recipes/{}/favorite/'
+    ),
+    'cart_toggle': toggle(
+        lambda f: f.not_in_cart_ids, '/api/recipes/{}/shopping_cart/'
+    ),
+    'subscribe_toggle': toggle(
+        lambda f: f.unfollowed_ids, '/api/users/{}/subscribe/'
+    ),
+}
+
+# Run in this order: update and delete work on the recipes create made.
+WRITE_SCENARIOS = {
+    'recipe_create': create_recipe,
+    'recipe_update': update_recipe,
+    'recipe_delete': delete_recipe,
+}
+
+SCENARIOS = {**READ_SCENARIOS, **TOGGLE_SCENARIOS, **WRITE_SCENARIOS}
+
+
+def summarize(samples):
+    durations = sorted(duration for duration, _, _, _ in samples)
+    queries = [count for _, _, count, _ in samples]
+    statuses = {}
+    for _, status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(samples),
+        'statuses': statuses,
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 3),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+        'bytes_mean': round(
+            sum(size for _, _, _, size in samples) / len(samples)
+        ),
+        # Requests run one after another, so this is per-worker throughput.
+        'throughput_rps': round(len(samples) / sum(durations), 1),
+    }
+
+
+def run_scenario(client, fixture, scenario, iterations, warmup=0):
+    # An even warmup leaves every toggle where it started.
+    for number in range(warmup + warmup % 2):
+        client.request(*scenario(fixture, number))
+    samples = []
+    for number in range(iterations):
+        request = scenario(fixture, number)
+        started = time.perf_counter()
+        status, content, queries = client.request(*request)
+        samples.append(
+            (time.perf_counter() - started, status, queries, len(content))
+        )
+        if scenario is create_recipe and status == 201:
+            fixture.created_ids.append(json.loads(content)['id'])
+    return summarize(samples)
@@ -0,0 +1,91 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag, urlencode
+
+from foodgram.metrics import cache_lookup
+from recipes.models import ContentVersion
+
+RECIPE_FEED_PARAMS = (
+    'tags', 'author', 'search', 'page', 'limit', 'cursor'
+)
+
+
+def conditional_response(request, render, etag, last_modified=None,
+                         cache_control='reference'):
+    """Answer with 304 when validators match, otherwise call ``render``.
+
+    ``last_modified`` is a POSIX timestamp. Responses that depend on the
+    requesting user are marked private and vary on Authorization.
+    """
+    etag = quote_etag(etag)
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=last_modified
+    )
+    cache_lookup('conditional', response is not None)
+    if response is None:
+        response = render()
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    cache_control = settings.API_CACHE_CONTROL[cache_control]
+    if request.user.is_authenticated:
+        cache_control = f'private, {cache_control}'
+    response['Cache-Control'] = cache_control
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def recipe_feed_cache():
+    return caches[settings.RECIPE_FEED_CACHE]
+
+
+def recipe_feed_key(request):
+    """Cache key for a recipe list page, None if the page is not cacheable.
+
+    Only the public filters are cacheable; their values are sorted so that
+    equivalent URLs share an entry. Recipe, tag and ingredient versions are
+    part of the key, so a change anywhere simply moves to fresh keys.
+    """
+    params = request.query_params
+    if not set(params).issubset(RECIPE_FEED_PARAMS):
+        return None
+    normalized = urlencode([
+        (name, value)
+        for name in RECIPE_FEED_PARAMS
+        for value in sorted(params.getlist(name))
+    ])
+    versions = ContentVersion.objects.get_versions(
+        'recipe',
+        'tag',
+        'ingredient'
+    )
+    digest = hashlib.md5(
+        f'{request.build_absolute_uri("/")}?{normalized}'.encode()
+    ).hexdigest()
+    return 'recipe-feed:{}:{}'.format('-'.join(map(str, versions)), digest)
+
+
+def overlay_viewer(data, viewer):
+    """Put the viewer's own flags onto a cached anonymous recipe page."""
+    return {
+        **data,
+        'results': [
+            {
+                **recipe,
+                'author': {
+                    **recipe['author'],
+                    'is_subscribed': (
+                        recipe['author']['id'] in viewer.following_ids
+                    )
+                },
+                'is_favorited': recipe['id'] in viewer.favorite_ids,
+                'is_in_shopping_cart': recipe['id'] in viewer.cart_ids
+            }
+            for recipe in data['results']
+        ]
+    }
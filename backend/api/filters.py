@@ -1,14 +1,11 @@
 from django_filters import filterset
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import OrderingFilter
 
 from recipes.models import Favorite, Recipe, Tag
+from recipes.search import search_recipes
 from users.models import Subscribe, CustomUser
 
 
-class IngredientSearchFilter(SearchFilter):
-    search_param = 'name'
-
-
 class RecipeFilterSet(filterset.FilterSet):
     tags = filterset.ModelMultipleChoiceFilter(
         field_name='tags__slug',
@@ -20,6 +17,7 @@ class RecipeFilterSet(filterset.FilterSet):
     )
     is_favorited = filterset.NumberFilter(method='get_is_favorited')
     is_in_shopping_cart = filterset.NumberFilter(method='get_is_in_shopping_cart')
+    search = filterset.CharFilter(method='get_search')
 
     class Meta:
         model = Recipe
@@ -27,7 +25,8 @@ class RecipeFilterSet(filterset.FilterSet):
             'tags',
             'author',
             'is_favorited',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'search'
         )
 
     def get_is_favorited(self, queryset, name, value):
@@ -39,3 +38,28 @@ class RecipeFilterSet(filterset.FilterSet):
         if self.request.user.is_authenticated and value:
             return queryset.filter(cart_recipe__owner=self.request.user)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+
+class RecipeOrderingFilter(OrderingFilter):
+    """?ordering=popular sorts by favorites_count (recipe_popular_idx).
+
+    Without an explicit ordering, ?search= results come best match first.
+    """
+    orderings = {'popular': ('-favorites_count', '-id')}
+    default_ordering = ('-id',)
+    search_ordering = ('-search_rank', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = self.orderings.get(
+            request.query_params.get(self.ordering_param)
+        )
+        if ordering is not None:
+            return ordering
+        if request.query_params.get('search', '').strip():
+            return self.search_ordering
+        return self.default_ordering
@@ -0,0 +1,244 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('api.queries')
+
+_state = threading.local()
+
+# IN (%s, %s, ...) lists of different length are the same query shape.
+PLACEHOLDER_LIST = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def current_profile():
+    return getattr(_state, 'profile', None)
+
+
+@contextmanager
+def execute_wrapper(connection, wrapper):
+    """connection.execute_wrapper() that takes off ``wrapper`` itself.
+
+    Django's pops the last wrapper, which is another one if the connection
+    installed its own meanwhile, see foodgram.metrics.
+    """
+    connection.execute_wrappers.append(wrapper)
+    try:
+        yield
+    finally:
+        connection.execute_wrappers.remove(wrapper)
+
+
+def when_sent(response, callback):
+    """Run ``callback`` once the response body has been produced.
+
+    That is now for ordinary responses. A streaming response runs its
+    queries while the server consumes it: then at the end of the content,
+    or when the response is closed unread.
+    """
+    if not response.streaming:
+        callback()
+        return
+    done = []
+
+    def finish():
+        if not done:
+            done.append(True)
+            callback()
+
+    def stream(content):
+        yield from content
+        finish()
+
+    response.streaming_content = stream(response.streaming_content)
+    response._resource_closers.append(finish)
+
+
+class RequestProfile:
+    """Query count, DB time and serializer/render timings of one request."""
+
+    def __init__(self, detect_repeats=False):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+        self.view_finished = None
+        self.field = None
+        self.depth = 0
+        self.shapes = Counter() if detect_repeats else None
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            if self.shapes is not None:
+                shape = PLACEHOLDER_LIST.sub('%s, ...', sql)
+                self.shapes[shape] += 1
+                self.origins.setdefault(shape, Counter())[self.field] += 1
+
+    def repeated(self, threshold):
+        """Query shapes run at least ``threshold`` times, with their origin."""
+        if self.shapes is None:
+            return []
+        return [
+            {
+                'count': count,
+                'field': self.origins[shape].most_common(1)[0][0],
+                'sql': shape[:200]
+            }
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+    def server_timing(self, total):
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+
+
+class ProfiledSerializerMixin:
+    """Adds serializer time and the field being rendered to the profile."""
+
+    def to_representation(self, instance):
+        profile = current_profile()
+        if profile is None:
+            return super().to_representation(instance)
+        profile.depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            profile.depth -= 1
+            if not profile.depth:
+                profile.serialize_time += time.perf_counter() - started
+
+    @property
+    def _readable_fields(self):
+        profile = current_profile()
+        for field in super()._readable_fields:
+            if profile is None:
+                yield field
+                continue
+            outer = profile.field
+            profile.field = f'{type(self).__name__}.{field.field_name}'
+            try:
+                yield field
+            finally:
+                profile.field = outer
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records queries, DB time, serializer and render time of every request.
+
+    The numbers go to the Server-Timing header and to a JSON line on the
+    ``api.queries`` logger. With QUERY_REPEAT_DETECTION repeated query
+    shapes (N+1) are logged with the serializer field that ran them.
+    Views may declare ``query_budget = {action: max_queries}``; going over
+    it is logged, and raises QueryBudgetExceeded with QUERY_BUDGET_STRICT.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_INSTRUMENTATION:
+            return self.get_response(request)
+        profile = _state.profile = RequestProfile(
+            settings.QUERY_REPEAT_DETECTION
+        )
+        request.query_budget = None
+        with ExitStack() as stack:
+            stack.callback(setattr, _state, 'profile', None)
+            for connection in connections.all():
+                stack.enter_context(execute_wrapper(connection, profile))
+            response = self.get_response(request)
+            stack = stack.pop_all()
+        # Up to the first byte for streaming responses, whose headers go
+        # out before the content runs.
+        response['Server-Timing'] = profile.server_timing(
+            time.perf_counter() - profile.started
+        )
+
+        def finish():
+            stack.close()
+            self.report(
+                request,
+                response,
+                profile,
+                time.perf_counter() - profile.started
+            )
+
+        when_sent(response, finish)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', None)
+        budgets = getattr(view, 'query_budget', None)
+        if not budgets:
+            return None
+        action = getattr(view_func, 'actions', {}).get(request.method.lower())
+        request.query_budget = (
+            f'{view.__name__}.{action}', budgets.get(action)
+        )
+        return None
+
+    def process_template_response(self, request, response):
+        profile = current_profile()
+        if profile is not None:
+            profile.view_finished = time.perf_counter()
+
+            def rendered(response):
+                profile.render_time = (
+                    time.perf_counter() - profile.view_finished
+                )
+            response.add_post_render_callback(rendered)
+        return response
+
+    def report(self, request, response, profile, total):
+        name, budget = getattr(request, 'query_budget', None) or (None, None)
+        repeated = profile.repeated(settings.QUERY_REPEAT_THRESHOLD)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': name,
+            'status': response.status_code,
+            'queries': profile.queries,
+            'budget': budget,
+            'db_ms': round(profile.db_time * 1000, 1),
+            'serialize_ms': round(profile.serialize_time * 1000, 1),
+            'render_ms': round(profile.render_time * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+        }))
+        for shape in repeated:
+            logger.warning(
+                'N+1 suspected in %s %s: %s queries from %s: %s',
+                request.method, request.path,
+                shape['count'], shape['field'] or 'the view', shape['sql']
+            )
+        if budget is not None and profile.queries > budget:
+            message = (
+                f'{name} ran {profile.queries} queries, '
+                f'budget is {budget}.'
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
@@ -0,0 +1,165 @@
+import json
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import (
+    SCENARIOS, WRITE_SCENARIOS, Fixture, WSGIClient, run_scenario
+)
+from recipes.models import Cart, Favorite, Ingredient, Recipe
+from users.models import CustomUser, Subscribe
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the main API endpoints in-process through the WSGI app and '
+        'report latency percentiles, queries per request and throughput. '
+        'Seed the database with generate_dataset first. Write scenarios '
+        'create, update and delete their own recipes; toggles undo '
+        'themselves.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=sorted(SCENARIOS),
+            help='Run only these scenarios (repeatable).'
+        )
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument(
+            '--write-iterations',
+            type=int,
+            default=20,
+            help='Iterations of the recipe create/update/delete scenarios.'
+        )
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--write-ingredients',
+            type=int,
+            default=50,
+            help='Ingredients per recipe in the write scenarios.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output',
+            type=Path,
+            help='JSON file for the results, '
+                 'benchmark-<date>-<time>.json by default.'
+        )
+        parser.add_argument(
+            '--compare',
+            type=Path,
+            help='Earlier results file to print the difference against.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            fixture = Fixture(options['seed'], options['write_ingredients'])
+        except ValueError as error:
+            raise CommandError(f'{error} Run generate_dataset first.')
+        if settings.DEBUG:
+            self.stderr.write(
+                'DEBUG is on: query logging and instrumentation '
+                'slow every request down.'
+            )
+        client = WSGIClient()
+        names = options['scenario'] or list(SCENARIOS)
+        if 'recipe_create' not in names:
+            names = [
+                name for name in names
+                if name not in ('recipe_update', 'recipe_delete')
+            ]
+        results = {}
+        for name in names:
+            writes = name in WRITE_SCENARIOS
+            results[name] = run_scenario(
+                client,
+                fixture,
+                SCENARIOS[name],
+                options['write_iterations' if writes else 'iterations'],
+                0 if writes else options['warmup']
+            )
+            self.print_row(name, results[name])
+        for recipe_id in fixture.created_ids:
+            client.request('DELETE', f'/api/recipes/{recipe_id}/',
+                           fixture.token)
+        report = {'meta': self.meta(options), 'scenarios': results}
+        output = options['output'] or Path(
+            time.strftime('benchmark-%Y%m%d-%H%M%S.json')
+        )
+        output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
+        if options['compare']:
+            self.compare(json.loads(options['compare'].read_text()), report)
+
+    def meta(self, options):
+        return {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'debug': bool(settings.DEBUG),
+            'iterations': options['iterations'],
+            'write_iterations': options['write_iterations'],
+            'write_ingredients': options['write_ingredients'],
+            'seed': options['seed'],
+            'dataset': {
+                'users': CustomUser.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+                'subscriptions': Subscribe.objects.count(),
+                'favorites': Favorite.objects.count(),
+                'carts': Cart.objects.count(),
+            },
+        }
+
+    def print_row(self, name, result):
+        self.stdout.write(
+            f'{name:24} {result["requests"]:5} req  '
+            f'p50 {result["p50_ms"]:8.2f}  p95 {result["p95_ms"]:8.2f}  '
+            f'p99 {result["p99_ms"]:8.2f} ms  '
+            f'{result["queries_mean"]:6.1f} q/req  '
+            f'{result["throughput_rps"]:8.1f} req/s  '
+            f'{result["statuses"]}'
+        )
+
+    def compare(self, before, after):
+        self.stdout.write(
+            f'Against {before["meta"].get("revision")} '
+            f'({before["meta"]["started_at"]}):'
+        )
+        for name, result in after['scenarios'].items():
+            old = before['scenarios'].get(name)
+            if old is None:
+                continue
+            self.stdout.write(
+                f'{name:24} '
+                + '  '.join(
+                    f'{key[:3]} {(result[key] / old[key] - 1) * 100:+6.1f}%'
+                    for key in ('p50_ms', 'p95_ms', 'p99_ms')
+                    if old[key]
+                )
+                + '  queries {:+.1f}'.format(
+                    result['queries_mean'] - old['queries_mean']
+                )
+            )
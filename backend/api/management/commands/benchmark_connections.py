@@ -0,0 +1,93 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from api.benchmark import READ_SCENARIOS, Fixture, WSGIClient, run_scenario
+
+# (CONN_MAX_AGE, CONN_HEALTH_CHECKS) of every mode.
+MODES = {
+    'new': (0, False),
+    'persistent': (None, False),
+    'checked': (None, True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the same request with a new database connection every time, '
+        'with a persistent one and with a persistent one pinged before '
+        'every request (CONN_HEALTH_CHECKS), to show the latency persistent '
+        'connections save. With DB_POOL_SIZE set, "new" checks a connection '
+        'out of the pool instead of opening one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario',
+            choices=sorted(READ_SCENARIOS),
+            default='recipe_detail'
+        )
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file for the results.')
+
+    def handle(self, *args, **options):
+        client = WSGIClient()
+        fixture = Fixture(seed=options['seed'])
+        scenario = READ_SCENARIOS[options['scenario']]
+        settings_dict = connection.settings_dict
+        saved = {
+            key: settings_dict.get(key)
+            for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')
+        }
+        results = {
+            'engine': settings_dict['ENGINE'],
+            'scenario': options['scenario'],
+            'modes': {},
+        }
+        opened = []
+
+        def count_connection(sender, **kwargs):
+            opened.append(sender)
+
+        connection_created.connect(count_connection)
+        try:
+            for mode, (max_age, health_checks) in MODES.items():
+                settings_dict['CONN_MAX_AGE'] = max_age
+                settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+                connection.close()
+                for number in range(options['warmup']):
+                    client.request(*scenario(fixture, number))
+                opened.clear()
+                result = results['modes'][mode] = run_scenario(
+                    client, fixture, scenario, options['iterations']
+                )
+                result['connections'] = len(opened)
+                self.stdout.write(
+                    f'{mode:10}: p50 {result["p50_ms"]:7.3f}  '
+                    f'p95 {result["p95_ms"]:7.3f}  '
+                    f'mean {result["mean_ms"]:7.3f} ms  '
+                    f'{result["connections"]} connections opened'
+                )
+        finally:
+            connection_created.disconnect(count_connection)
+            settings_dict.update(saved)
+            connection.close()
+        modes = results['modes']
+        results['saved_mean_ms'] = round(
+            modes['new']['mean_ms'] - modes['persistent']['mean_ms'], 3
+        )
+        results['health_check_mean_ms'] = round(
+            modes['checked']['mean_ms'] - modes['persistent']['mean_ms'], 3
+        )
+        self.stdout.write(
+            f'persistent connections save {results["saved_mean_ms"]:.3f} ms '
+            f'per request, health checks cost '
+            f'{results["health_check_mean_ms"]:.3f} ms'
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
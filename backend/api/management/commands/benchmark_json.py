@@ -0,0 +1,108 @@
+import io
+import json
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api import renderers
+from api.benchmark import percentile
+from api.serializers import RecipeReadSerializer
+from api.utils import Viewer
+from recipes.models import Recipe
+
+
+def measure(function, iterations):
+    durations = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    return {
+        'p50_us': round(percentile(durations, 50) * 1e6, 1),
+        'p95_us': round(percentile(durations, 95) * 1e6, 1),
+        'mean_us': round(sum(durations) / len(durations) * 1e6, 1),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare DRF JSONRenderer/JSONParser with the orjson-backed '
+        'FastJSONRenderer/FastJSONParser on a page of recipes, and check '
+        'that both render the same bytes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--output', help='JSON file for the results.')
+
+    def handle(self, *args, **options):
+        request = APIRequestFactory(SERVER_NAME='localhost').get(
+            '/api/recipes/'
+        )
+        request.user = AnonymousUser()
+        recipes = list(
+            Recipe.objects.with_related().order_by('-id')[
+                :options['page_size']
+            ]
+        )
+        if not recipes:
+            raise CommandError('No recipes, run generate_dataset first.')
+        data = {
+            'count': len(recipes),
+            'next': None,
+            'previous': None,
+            'results': RecipeReadSerializer(
+                recipes,
+                many=True,
+                context={'request': request, 'viewer': Viewer(request.user)}
+            ).data,
+        }
+        stdlib, fast = JSONRenderer(), renderers.FastJSONRenderer()
+        content = stdlib.render(data)
+        if fast.render(data) != content:
+            raise CommandError('FastJSONRenderer output differs from '
+                               'JSONRenderer.')
+        iterations = options['iterations']
+        results = {
+            'orjson': renderers.orjson is not None,
+            'page_size': len(recipes),
+            'bytes': len(content),
+            'render': {
+                'stdlib': measure(lambda: stdlib.render(data), iterations),
+                'fast': measure(lambda: fast.render(data), iterations),
+            },
+            'parse': {
+                'stdlib': measure(
+                    lambda: JSONParser().parse(io.BytesIO(content)),
+                    iterations
+                ),
+                'fast': measure(
+                    lambda: renderers.FastJSONParser().parse(
+                        io.BytesIO(content)
+                    ),
+                    iterations
+                ),
+            },
+        }
+        if not results['orjson']:
+            self.stderr.write('orjson is not installed, both paths use json.')
+        self.stdout.write(
+            f'{len(recipes)} recipes, {len(content)} bytes, '
+            f'{iterations} iterations'
+        )
+        for operation in ('render', 'parse'):
+            timings = results[operation]
+            self.stdout.write(
+                f'{operation:7} stdlib p50 {timings["stdlib"]["p50_us"]:9.1f} '
+                f'us   fast p50 {timings["fast"]["p50_us"]:9.1f} us   '
+                f'x{timings["stdlib"]["p50_us"] / timings["fast"]["p50_us"]:.1f}'
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
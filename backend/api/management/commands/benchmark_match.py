@@ -0,0 +1,143 @@
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Q
+
+from api.benchmark import percentile
+from recipes.matching import recipe_match_index
+from recipes.models import Recipe, RecipeIngredient
+
+
+def match_sql(ingredient_ids, max_missing):
+    """The same matching done by the database, id -> missing."""
+    return dict(Recipe.objects.annotate(
+        total=Count('recipeingredient'),
+        matched=Count(
+            'recipeingredient',
+            filter=Q(recipeingredient__ingredient_id__in=ingredient_ids)
+        )
+    ).filter(
+        matched__gt=0,
+        total__lte=F('matched') + max_missing
+    ).annotate(
+        missing=F('total') - F('matched')
+    ).values_list('id', 'missing'))
+
+
+def timings(durations):
+    durations = sorted(durations)
+    return {
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the in-memory ingredient matching index behind '
+        '/api/recipes/match/ against the equivalent SQL aggregation, and '
+        'check that both find the same recipes. Pantries are drawn from '
+        'ingredients weighted by how many recipes use them. Touches '
+        'Recipe.modified of one recipe to time an incremental sync.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pantry-size',
+            type=int,
+            action='append',
+            help='Ingredients per pantry (repeatable), 5, 10 and 20 '
+                 'by default.'
+        )
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument(
+            '--sql-iterations',
+            type=int,
+            default=5,
+            help='Pantries also run through SQL and compared.'
+        )
+        parser.add_argument(
+            '--max-missing',
+            type=int,
+            default=settings.RECIPE_MATCH_MAX_MISSING
+        )
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='JSON file for the results.')
+
+    def handle(self, *args, **options):
+        usage = list(RecipeIngredient.objects.values(
+            'ingredient_id'
+        ).annotate(recipes=Count('id')).values_list(
+            'ingredient_id', 'recipes'
+        ))
+        if not usage:
+            raise CommandError('No recipes, run generate_dataset first.')
+        rng = random.Random(options['seed'])
+        max_missing = options['max_missing']
+        started = time.perf_counter()
+        stats = recipe_match_index.stats()
+        results = {
+            **stats,
+            'build_s': round(time.perf_counter() - started, 3),
+            'max_missing': max_missing,
+            'pantries': {},
+        }
+        self.stdout.write(
+            f'{results["recipes"]} recipes, {results["ingredients"]} '
+            f'ingredients: built in {results["build_s"]:.2f} s, '
+            f'~{results["memory_bytes"] / 2 ** 20:.1f} MiB'
+        )
+        ids, weights = zip(*usage)
+        for size in options['pantry_size'] or (5, 10, 20):
+            pantries = []
+            for _ in range(options['iterations']):
+                pantry = set()
+                while len(pantry) < min(size, len(ids)):
+                    pantry.add(rng.choices(ids, weights)[0])
+                pantries.append(pantry)
+            durations = []
+            found = []
+            for pantry in pantries:
+                started = time.perf_counter()
+                matches = recipe_match_index.match(pantry, max_missing)
+                matches[:options['page_size']]
+                durations.append(time.perf_counter() - started)
+                found.append(len(matches))
+            sql_durations = []
+            for pantry in pantries[:options['sql_iterations']]:
+                started = time.perf_counter()
+                expected = match_sql(pantry, max_missing)
+                sql_durations.append(time.perf_counter() - started)
+                if dict(recipe_match_index.match(
+                        pantry, max_missing)[:]) != expected:
+                    raise CommandError(
+                        f'Index and SQL disagree for pantry {sorted(pantry)}.'
+                    )
+            result = results['pantries'][size] = {
+                'index': timings(durations),
+                'sql': timings(sql_durations) if sql_durations else None,
+                'matches_mean': round(sum(found) / len(found), 1),
+            }
+            line = (
+                f'pantry {size:3}: index p50 {result["index"]["p50_ms"]:8.3f} '
+                f'p95 {result["index"]["p95_ms"]:8.3f} ms'
+            )
+            if result['sql']:
+                line += f'   sql p50 {result["sql"]["p50_ms"]:9.1f} ms'
+            self.stdout.write(f'{line}   {result["matches_mean"]} matches')
+        recipe = Recipe.objects.order_by('?').first()
+        recipe.save(update_fields=['modified'])
+        started = time.perf_counter()
+        recipe_match_index.match((), 0)
+        results['sync_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self.stdout.write(
+            f'sync after one recipe edit: {results["sync_ms"]:.1f} ms'
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
@@ -1,6 +1,85 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
-class PageLimitPagination(PageNumberPagination):
+class LimitCursorPagination(CursorPagination):
+    """Keyset pagination over -id; the total count is only run on request.
+
+    Pages are always newest first: an ?ordering= or search ranking is
+    ignored, as a cursor on a non-unique field such as favorites_count
+    would make DRF fall back to offsets.
+    """
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = '-id'
+    count_query_param = 'with_count'
+
+    def get_ordering(self, request, queryset, view):
+        return (self.ordering,)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = {'count': self.count, **response.data}
+        return response
+
+
+class FeedCursorPagination(CursorPagination):
+    """Keyset pagination over -id for a feed made of several sources."""
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = '-id'
+
+    def candidate_ids(self, request, sources):
+        """Recipe ids the requested page can be built from.
+
+        ``sources`` are (queryset, recipe id field) pairs. Each is read
+        with its own index for the first ids past the cursor; the page
+        taken from the union of those is the page of the whole feed.
+        """
+        cursor = self.decode_cursor(request)
+        limit = self.get_page_size(request) + 1
+        reverse = False
+        if cursor is not None:
+            limit += cursor.offset
+            reverse = cursor.reverse
+        ids = set()
+        for queryset, field in sources:
+            if cursor is not None and cursor.position is not None:
+                lookup = 'gt' if reverse else 'lt'
+                queryset = queryset.filter(
+                    **{f'{field}__{lookup}': cursor.position}
+                )
+            ids.update(queryset.order_by(
+                field if reverse else f'-{field}'
+            ).values_list(field, flat=True)[:limit])
+        return ids
+
+
+class PageNumberLimitPagination(PageNumberPagination):
+    """Page number pagination; also pages lists and other sequences."""
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class PageLimitPagination(PageNumberLimitPagination):
+    """Page number pagination, switching to keyset mode on ?cursor=."""
+    cursor_query_param = 'cursor'
+    cursor_class = LimitCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor = self.cursor_class()
+            return self.cursor.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor is not None:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,12 +1,67 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db.transaction import atomic
 from drf_extra_fields.fields import Base64ImageField
-from rest_framework import serializers, status
+from rest_framework import serializers
 
 from recipes import models
+from recipes.images import release_recipe_image, schedule_recipe_image
 from users.models import CustomUser, Subscribe
+from .instrumentation import ProfiledSerializerMixin
+from .utils import Viewer
 
 
-class UserSerializer(serializers.ModelSerializer):
+class LimitedBase64ImageField(Base64ImageField):
+    """Rejects payloads over RECIPE_IMAGE_MAX_BYTES before decoding them."""
+
+    def to_internal_value(self, base64_data):
+        limit = settings.RECIPE_IMAGE_MAX_BYTES
+        if (isinstance(base64_data, str)
+                and len(base64_data) > limit * 4 // 3 + 256):
+            raise serializers.ValidationError(
+                f'Изображение больше {limit // (1024 * 1024)} МБ!'
+            )
+        return super().to_internal_value(base64_data)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """{format: {width: url}} of the resized copies built in background.
+
+    URLs are absolute when there is a request in the context, MEDIA_URL
+    based otherwise (admin, shell, management commands).
+    """
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        build_url = default_storage.url
+        if request is not None:
+            def build_url(path):
+                return request.build_absolute_uri(default_storage.url(path))
+        return {
+            image_format: {
+                width: build_url(path) for width, path in widths.items()
+            }
+            for image_format, widths in value.items()
+        }
+
+
+class ViewerSerializerMixin:
+
+    @property
+    def viewer(self):
+        viewer = self.context.get('viewer')
+        if viewer is None:
+            viewer = self.context['viewer'] = Viewer(
+                self.context.get('request').user
+            )
+        return viewer
+
+
+class UserSerializer(
+    ViewerSerializerMixin,
+    ProfiledSerializerMixin,
+    serializers.ModelSerializer
+):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -22,10 +77,7 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ('is_subscribed',)
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if not user.is_anonymous:
-            return Subscribe.objects.filter(user=user, following=obj).exists()
-        return False
+        return obj.id in self.viewer.following_ids
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -55,7 +107,10 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return user
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(
+    ProfiledSerializerMixin,
+    serializers.ModelSerializer
+):
     email = serializers.EmailField(source='following.email', read_only=True)
     id = serializers.IntegerField(source='following.id', read_only=True)
     username = serializers.CharField(source='following.username', read_only=True)
@@ -84,64 +139,47 @@ class SubscribeSerializer(serializers.ModelSerializer):
             'last_name'
         )
 
-    def validate(self, attrs):
-        user = self.context.get('request').user
-        following = self.context.get('following')
-        if user == following:
-            raise serializers.ValidationError(
-                {'errors': 'Вы не можете подписаться на себя!'},
-                status.HTTP_400_BAD_REQUEST
-            )
-        if Subscribe.objects.filter(
-                user=user,
-                following=following
-        ).exists():
-            raise serializers.ValidationError(
-                {'errors': 'Вы уже подписаны на этого пользователя!'},
-                status.HTTP_400_BAD_REQUEST
-            )
-        return attrs
-
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if not user.is_anonymous:
-            return Subscribe.objects.filter(user=user, following=obj.following).exists()
-        return False
+        return obj.user_id == self.context.get('request').user.id
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.GET.get('recipes_limit')
         recipes = obj.following.recipes.all()
+        recipes_limit = self.context.get('recipes_limit')
         if recipes_limit:
-            return RecipeShortSerializer(
-                recipes[:int(recipes_limit)],
-                many=True,
-                context={'request': request}).data
+            recipes = recipes[:recipes_limit]
         return RecipeShortSerializer(
             recipes,
             many=True,
-            context={'request': request}
+            context=self.context
         ).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.following.recipes.count()
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = models.Tag
         fields = '__all__'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(
+    ProfiledSerializerMixin,
+    serializers.ModelSerializer
+):
 
     class Meta:
         model = models.Ingredient
         fields = '__all__'
 
 
-class RecipeIngredientReadSerializer(serializers.ModelSerializer):
+class RecipeIngredientReadSerializer(
+    ProfiledSerializerMixin,
+    serializers.ModelSerializer
+):
     id = serializers.ReadOnlyField(source='ingredient.id')
     name = serializers.ReadOnlyField(source='ingredient.name')
     measurement_unit = serializers.ReadOnlyField(source='ingredient.measurement_unit')
@@ -157,17 +195,19 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=models.Ingredient.objects.all()
-    )
-    amount = serializers.IntegerField()
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = models.RecipeIngredient
         fields = ('id', 'amount')
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(
+    ViewerSerializerMixin,
+    ProfiledSerializerMixin,
+    serializers.ModelSerializer
+):
     tags = TagSerializer(
         many=True,
         read_only=True
@@ -178,10 +218,11 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientReadSerializer(
         many=True,
         read_only=True,
-        source='recipe.ingredients'
+        source='recipeingredient_set'
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = models.Recipe
@@ -194,21 +235,23 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time'
         )
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if not user.is_anonymous:
-            return models.Favorite.objects.filter(recipe=obj).exists()
-        return False
+        return obj.id in self.viewer.favorite_ids
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if not user.is_anonymous:
-            return models.Cart.objects.filter(recipe=obj).exists()
-        return False
+        return obj.id in self.viewer.cart_ids
+
+
+class RecipeMatchSerializer(RecipeReadSerializer):
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + ('missing',)
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
@@ -223,7 +266,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         many=True,
         write_only=True,
     )
-    image = Base64ImageField()
+    image = LimitedBase64ImageField()
 
     class Meta:
         model = models.Recipe
@@ -256,6 +299,18 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
     def validate_ingredients(self, value):
         if not value:
             raise serializers.ValidationError('Добавьте ингредиенты!')
+        ids = [ingredient['id'] for ingredient in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться!'
+            )
+        missing = set(ids) - set(models.Ingredient.objects.filter(
+            id__in=ids
+        ).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {sorted(missing)}'
+            )
         return value
 
     def validate_tags(self, value):
@@ -263,38 +318,106 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Добавьте теги!')
         return value
 
-    @atomic
-    def tags_and_ingredients(self, recipe, ingredients, tags):
-        recipe.tags.set(tags)
-        for ingredient in ingredients:
-            models.RecipeIngredient.objects.create(
+    @staticmethod
+    def create_ingredients(recipe, amounts):
+        models.RecipeIngredient.objects.bulk_create(
+            models.RecipeIngredient(
                 recipe=recipe,
-                ingredient=ingredient['id'],
-                amount=ingredient['amount']
+                ingredient_id=ingredient_id,
+                amount=amount
             )
+            for ingredient_id, amount in amounts.items()
+        )
 
     def to_representation(self, instance):
-        return RecipeReadSerializer(instance, context=self.context).data
+        return RecipeReadSerializer(
+            models.Recipe.objects.with_related().get(pk=instance.pk),
+            context=self.context
+        ).data
 
     @atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = super().create(validated_data)
-        recipe.tags.set(tags)
-        self.tags_and_ingredients(recipe, ingredients, tags)
+        schedule_recipe_image(recipe)
+        recipe.tags.add(*tags)
+        self.create_ingredients(recipe, {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        })
         return recipe
 
     @atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        instance.ingredients.clear()
-        self.tags_and_ingredients(instance, ingredients, tags)
-        return super().update(instance, validated_data)
-
-
-class RecipeShortSerializer(serializers.ModelSerializer):
+        instance.tags.set(tags)
+        new_amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        existing = {
+            row.ingredient_id: row
+            for row in instance.recipeingredient_set.all()
+        }
+        # bulk_create and bulk_update send no signals, so the cart totals
+        # of the rows they write are updated here; see recipes.signals.
+        # Removed rows join them rather than settle their totals one by
+        # one on delete.
+        deltas = {
+            ingredient_id: -existing.pop(ingredient_id).amount
+            for ingredient_id in existing.keys() - new_amounts.keys()
+        }
+        if deltas:
+            removed = instance.recipeingredient_set.filter(
+                ingredient_id__in=deltas
+            )
+            removed.cart_totals_settled = True
+            removed.delete()
+        changed = []
+        for ingredient_id, row in existing.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                deltas[ingredient_id] = amount - row.amount
+                row.amount = amount
+                changed.append(row)
+        added = {
+            ingredient_id: amount
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in existing
+        }
+        if added:
+            self.create_ingredients(instance, added)
+            deltas.update(added)
+        if changed:
+            models.RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if deltas:
+            models.CartIngredient.objects.add_amounts(
+                instance.cart_owner_ids(),
+                deltas
+            )
+        old_image = instance.image.name
+        image = validated_data.pop('image', None)
+        if image is not None:
+            # Stored up front, so the name it gets is known before the
+            # recipe row is saved.
+            instance.image.save(image.name, image, save=False)
+        changed_image = instance.image.name != old_image
+        if changed_image:
+            validated_data['image_variants'] = {}
+        instance = super().update(instance, validated_data)
+        if changed_image:
+            release_recipe_image(old_image)
+            schedule_recipe_image(instance)
+        return instance
+
+
+class RecipeShortSerializer(
+    ProfiledSerializerMixin,
+    serializers.ModelSerializer
+):
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = models.Recipe
@@ -302,11 +425,15 @@ class RecipeShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time'
         )
 
 
-class BaseCartFavoriteSerializer(serializers.ModelSerializer):
+class BaseCartFavoriteSerializer(
+    ProfiledSerializerMixin,
+    serializers.ModelSerializer
+):
     id = serializers.PrimaryKeyRelatedField(source='recipe.id', read_only=True)
     name = serializers.CharField(source='recipe.name', read_only=True)
     image = serializers.ImageField(source='recipe.image', read_only=True)
@@ -0,0 +1,57 @@
+import csv
+import json
+
+CHUNK_SIZE = 8192
+
+
+class Echo:
+    """Pseudo-buffer that hands csv.writer output straight back."""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(rows):
+    for name, amount, unit in rows:
+        yield f'{name} - {amount} {unit}.\n'
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def render_json(rows):
+    separator = '['
+    for name, amount, unit in rows:
+        yield separator + json.dumps(
+            {'name': name, 'amount': amount, 'measurement_unit': unit},
+            ensure_ascii=False
+        )
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+RENDERERS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'json': ('application/json', render_json),
+}
+
+
+def stream(renderer, rows):
+    """Encode rendered pieces and yield them in CHUNK_SIZE-ish blocks."""
+    buffer = []
+    size = 0
+    for piece in renderer(rows):
+        piece = piece.encode('utf-8')
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
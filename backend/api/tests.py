@@ -0,0 +1,855 @@
+import base64
+import io
+import json
+import logging
+import re
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from prometheus_client import REGISTRY
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.serializers import RecipeWriteSerializer
+from foodgram.metrics import count_query
+from recipes.models import (
+    Cart, CartIngredient, ContentVersion, Favorite, Ingredient, Recipe,
+    RecipeIngredient, Tag
+)
+from recipes.matching import RecipeMatchIndex
+from recipes.search import IngredientIndex
+from users.models import CustomUser, Subscribe
+
+
+query_logger = logging.getLogger('api.queries')
+query_log_level = query_logger.level
+
+
+def setUpModule():
+    # One JSON line per request from the query instrumentation otherwise.
+    query_logger.setLevel(logging.ERROR)
+
+
+def tearDownModule():
+    query_logger.setLevel(query_log_level)
+
+
+def create_user(username):
+    return CustomUser.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password',
+        first_name=username,
+        last_name=username
+    )
+
+
+def token_client(user):
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}'
+    )
+    return client
+
+
+def png_data_uri(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def use_temp_media(test):
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media = override_settings(MEDIA_ROOT=media_root)
+    media.enable()
+    test.addCleanup(media.disable)
+
+
+class FixtureMixin:
+
+    @classmethod
+    def create_fixture(cls):
+        for name in ('recipe', 'tag', 'ingredient'):
+            ContentVersion.objects.get_or_create(name=name)
+        cls.user = create_user('viewer')
+        cls.authors = [create_user(f'author{number}') for number in range(3)]
+        cls.tags = [
+            Tag.objects.create(name=slug, slug=slug, color='#49B64E')
+            for slug in ('breakfast', 'lunch')
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(10)
+        ]
+        for number in range(12):
+            cls.create_recipe(cls.authors[number % 3], number)
+        for author in cls.authors[:2]:
+            Subscribe.objects.create(user=cls.user, following=author)
+
+    @classmethod
+    def create_recipe(cls, author, number):
+        recipe = Recipe.objects.create(
+            author=author,
+            name=f'Рецепт {number}',
+            image='recipes/test.png',
+            text='Текст',
+            cooking_time=10
+        )
+        recipe.tags.set(cls.tags[:number % 2 + 1])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in cls.ingredients[number % 5:number % 5 + 4]
+        )
+        return recipe
+
+
+class ApiTestCase(FixtureMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+    def setUp(self):
+        caches['recipes'].clear()
+        self.client = token_client(self.user)
+
+
+class QueryCountTest(ApiTestCase):
+    """The query count of list endpoints does not grow with the page."""
+
+    def test_recipe_list(self):
+        for limit in (2, 10):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(9):
+                    response = self.client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipe_list_anonymous(self):
+        client = APIClient()
+        for limit in (2, 10):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(5):
+                    response = client.get(f'/api/recipes/?limit={limit}')
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_subscriptions(self):
+        for limit, recipes_limit in ((1, 1), (2, 4)):
+            with self.subTest(limit=limit, recipes_limit=recipes_limit):
+                with self.assertNumQueries(4):
+                    response = self.client.get(
+                        f'/api/users/subscriptions/?limit={limit}'
+                        f'&recipes_limit={recipes_limit}'
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+                for author in response.data['results']:
+                    self.assertEqual(len(author['recipes']), recipes_limit)
+
+    @override_settings(SUBSCRIPTION_RECIPES_MAX_LIMIT=2)
+    def test_subscriptions_recipes_capped(self):
+        for url in (
+            '/api/users/subscriptions/',
+            '/api/users/subscriptions/?recipes_limit=3',
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                for author in response.data['results']:
+                    self.assertEqual(len(author['recipes']), 2)
+                    self.assertEqual(author['recipes_count'], 4)
+
+
+class RecipeWriteQueryCountTest(ApiTestCase):
+    """Writing a recipe takes as many queries for 50 ingredients as for 5."""
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media(self)
+        self.pool = Ingredient.objects.bulk_create(
+            Ingredient(name=f'продукт {number}', measurement_unit='г')
+            for number in range(75)
+        )
+        self.author_client = token_client(self.authors[0])
+
+    def payload(self, ingredients, amount):
+        return {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient in ingredients
+            ],
+            'tags': [self.tags[0].id],
+            'image': png_data_uri('red'),
+            'name': 'Суп',
+            'text': 'Текст',
+            'cooking_time': 5
+        }
+
+    def write(self, method, url, data, status):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.author_client, method)(
+                url, data, format='json'
+            )
+        self.assertEqual(response.status_code, status)
+        return response, len(queries)
+
+    def test_create_and_update(self):
+        counts = {}
+        for size in (5, 50):
+            # The update keeps, changes, removes and adds size / 2 rows
+            # each, on a recipe in the viewer's cart.
+            response, create = self.write(
+                'post',
+                '/api/recipes/',
+                self.payload(self.pool[:size], 10),
+                201
+            )
+            url = f'/api/recipes/{response.data["id"]}/'
+            self.client.post(f'{url}shopping_cart/')
+            _, update = self.write(
+                'put',
+                url,
+                self.payload(self.pool[size // 2:size + size // 2], 7),
+                200
+            )
+            counts[size] = (create, update)
+            self.assertEqual(
+                dict(CartIngredient.objects.filter(
+                    owner=self.user
+                ).values_list('ingredient_id', 'amount')),
+                {ingredient.id: 7
+                 for ingredient in self.pool[size // 2:size + size // 2]}
+            )
+            Recipe.objects.filter(id=response.data['id']).delete()
+        self.assertEqual(counts[50], counts[5])
+
+
+class IngredientSearchTest(ApiTestCase):
+
+    def test_case_insensitive(self):
+        Ingredient.objects.create(name='Onion', measurement_unit='г')
+        Ingredient.objects.create(name='Red onion', measurement_unit='г')
+        for in_memory in (True, False):
+            with self.subTest(in_memory=in_memory), override_settings(
+                INGREDIENT_SEARCH_IN_MEMORY=in_memory
+            ), mock.patch(
+                'recipes.search.ingredient_index', IngredientIndex()
+            ):
+                response = self.client.get('/api/ingredients/?name=ONION')
+                self.assertEqual(
+                    [ingredient['name'] for ingredient in response.data],
+                    ['Onion', 'Red onion']
+                )
+
+
+class RecipeCounterTest(ApiTestCase):
+    """favorites_count and carts_count follow every Favorite/Cart change."""
+
+    def assertCounters(self, recipe, favorites, carts):
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.carts_count),
+            (favorites, carts)
+        )
+
+    def test_counters(self):
+        recipe, other = Recipe.objects.order_by('id')[:2]
+        for action in ('favorite', 'shopping_cart'):
+            self.client.post(f'/api/recipes/{recipe.id}/{action}/')
+        self.assertCounters(recipe, 1, 1)
+        author = self.authors[2]
+        Favorite.objects.create(owner=author, recipe=recipe)
+        cart = Cart.objects.create(owner=author, recipe=recipe)
+        self.assertCounters(recipe, 2, 2)
+        cart.recipe = other
+        cart.save()
+        self.assertCounters(recipe, 2, 1)
+        self.assertCounters(other, 0, 1)
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertCounters(recipe, 1, 1)
+        author.delete()
+        self.assertCounters(recipe, 0, 1)
+        call_command('recipe_counters', '--verify', stdout=io.StringIO())
+
+
+class CursorPaginationTest(ApiTestCase):
+
+    def test_pages_by_id_position(self):
+        url = '/api/recipes/?cursor=&limit=5&ordering=popular'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+            if url:
+                cursor = parse_qs(urlparse(url).query)['cursor'][0]
+                # A position, no offset to skip rows from.
+                self.assertEqual(
+                    parse_qs(base64.b64decode(cursor).decode()),
+                    {'p': [str(seen[-1])]}
+                )
+        self.assertEqual(
+            seen,
+            list(Recipe.objects.order_by('-id').values_list('id', flat=True))
+        )
+
+
+class HotQueryPlanTest(ApiTestCase):
+    """Toggles, flag filters and tag filtering read indexes, not tables."""
+
+    # Plan lines that mean a whole table is read.
+    FULL_SCAN = {
+        'postgresql': re.compile(r'Seq Scan on (\w+)'),
+        'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING (?:COVERING )?INDEX)'),
+    }
+
+    def hot_queries(self):
+        user_id = self.user.id
+        recipe_id = Recipe.objects.values_list('id', flat=True).first()
+        return {
+            'favorite exists': Favorite.objects.filter(
+                owner_id=user_id, recipe_id=recipe_id
+            ).values('id')[:1],
+            'cart exists': Cart.objects.filter(
+                owner_id=user_id, recipe_id=recipe_id
+            ).values('id')[:1],
+            'subscribe exists': Subscribe.objects.filter(
+                user_id=user_id, following_id=self.authors[0].id
+            ).values('id')[:1],
+            'is_favorited filter': Recipe.objects.filter(
+                favorite_recipe__owner_id=user_id
+            ).values('id'),
+            'is_in_shopping_cart filter': Recipe.objects.filter(
+                cart_recipe__owner_id=user_id
+            ).values('id'),
+            'tags filter': Recipe.objects.filter(
+                tags__slug__in=[self.tags[0].slug]
+            ).values('id'),
+            'shopping list': CartIngredient.objects.filter(
+                owner_id=user_id
+            ).values('ingredient_id', 'amount'),
+        }
+
+    def test_no_full_scans(self):
+        pattern = self.FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            self.skipTest(f'No plan check for {connection.vendor}.')
+        if connection.vendor == 'postgresql':
+            # A Seq Scan left then means no usable index, whatever the
+            # size of the tables.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(pattern.findall(plan), [], plan)
+
+
+class MetricsTest(ApiTestCase):
+
+    def test_streaming_response_queries(self):
+        labels = {
+            'route': 'RecipeViewSet.download_shopping_cart',
+            'method': 'GET'
+        }
+        before = REGISTRY.get_sample_value(
+            'foodgram_db_queries_sum', labels
+        ) or 0
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        b''.join(response.streaming_content)
+        # The token lookup, then the rows read while streaming.
+        self.assertEqual(
+            REGISTRY.get_sample_value('foodgram_db_queries_sum', labels),
+            before + 2
+        )
+
+
+class ViewerFlagsTest(ApiTestCase):
+    """Flags describe the requesting user, on cached pages too."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = list(Recipe.objects.order_by('id')[:3])
+        self.other = create_user('other')
+        self.other_client = token_client(self.other)
+        self.client.post(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.client.post(f'/api/recipes/{self.recipes[1].id}/favorite/')
+        for action in ('shopping_cart', 'favorite'):
+            self.other_client.post(
+                f'/api/recipes/{self.recipes[2].id}/{action}/'
+            )
+        self.other_client.post(f'/api/users/{self.authors[2].id}/subscribe/')
+
+    def flags(self, user, recipe_id, author_id):
+        carts = {
+            self.user: {self.recipes[0].id},
+            self.other: {self.recipes[2].id},
+        }
+        favorites = {
+            self.user: {self.recipes[1].id},
+            self.other: {self.recipes[2].id},
+        }
+        following = {
+            self.user: {author.id for author in self.authors[:2]},
+            self.other: {self.authors[2].id},
+        }
+        return (
+            recipe_id in favorites[user],
+            recipe_id in carts[user],
+            author_id in following[user]
+        )
+
+    def assertFlags(self, user, recipe):
+        self.assertEqual(
+            (
+                recipe['is_favorited'],
+                recipe['is_in_shopping_cart'],
+                recipe['author']['is_subscribed']
+            ),
+            self.flags(user, recipe['id'], recipe['author']['id']),
+            recipe['id']
+        )
+
+    def test_list(self):
+        # The first URL is served from the anonymous page cache, filled by
+        # the anonymous request; the second one is not cacheable.
+        for url in (
+            '/api/recipes/?limit=12',
+            '/api/recipes/?limit=12&is_favorited=0',
+        ):
+            APIClient().get(url)
+            for user, client in (
+                (self.other, self.other_client),
+                (self.user, self.client),
+            ):
+                with self.subTest(url=url, user=user.username):
+                    response = client.get(url)
+                    self.assertEqual(len(response.data['results']), 12)
+                    for recipe in response.data['results']:
+                        self.assertFlags(user, recipe)
+
+    def test_anonymous_list(self):
+        response = APIClient().get('/api/recipes/?limit=12')
+        for recipe in response.data['results']:
+            self.assertEqual(
+                (
+                    recipe['is_favorited'],
+                    recipe['is_in_shopping_cart'],
+                    recipe['author']['is_subscribed']
+                ),
+                (False, False, False)
+            )
+
+    def test_retrieve(self):
+        for recipe in self.recipes:
+            for user, client in (
+                (self.other, self.other_client),
+                (self.user, self.client),
+            ):
+                with self.subTest(recipe=recipe.id, user=user.username):
+                    self.assertFlags(
+                        user,
+                        client.get(f'/api/recipes/{recipe.id}/').data
+                    )
+
+    def test_filters(self):
+        for flag, expected in (
+            ('is_favorited', [self.recipes[1].id]),
+            ('is_in_shopping_cart', [self.recipes[0].id]),
+        ):
+            with self.subTest(flag=flag):
+                response = self.client.get(f'/api/recipes/?{flag}=1')
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.data['results']],
+                    expected
+                )
+
+
+class ShoppingListExportTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ingredients[0].measurement_unit = 'шт'
+        self.ingredients[0].save()
+        for recipe in Recipe.objects.order_by('id')[:2]:
+            self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        # Recipes 0 and 1 use ingredients 0-3 and 1-4, 10 of each.
+        self.rows = [
+            (ingredient.name, 20 if 1 <= number <= 3 else 10,
+             ingredient.measurement_unit)
+            for number, ingredient in enumerate(self.ingredients[:5])
+        ]
+
+    def download(self, file_type):
+        response = self.client.get(
+            f'/api/recipes/download_shopping_cart/?type={file_type}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="ShoppingList.{file_type}"'
+        )
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_txt(self):
+        response, content = self.download('txt')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(content, ''.join(
+            f'{name} - {amount} {unit}.\n' for name, amount, unit in self.rows
+        ))
+
+    def test_csv(self):
+        response, content = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(
+            content.splitlines(),
+            ['name,amount,measurement_unit'] + [
+                f'{name},{amount},{unit}' for name, amount, unit in self.rows
+            ]
+        )
+
+    def test_json(self):
+        response, content = self.download('json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(content), [
+            {'name': name, 'amount': amount, 'measurement_unit': unit}
+            for name, amount, unit in self.rows
+        ])
+
+    def test_empty(self):
+        Cart.objects.filter(owner=self.user).delete()
+        self.assertEqual(json.loads(self.download('json')[1]), [])
+        self.assertEqual(self.download('txt')[1], '')
+
+    def test_unknown_type(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?type=pdf'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeMatchTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch(
+            'api.views.recipe_match_index', RecipeMatchIndex()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fewest_missing_first(self):
+        pantry = {ingredient.id for ingredient in self.ingredients[:4]}
+        response = self.client.get(
+            '/api/recipes/match/?limit=50&ingredients='
+            + ','.join(map(str, pantry))
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        expected = {}
+        for recipe in Recipe.objects.prefetch_related('ingredients'):
+            ingredient_ids = {
+                ingredient.id for ingredient in recipe.ingredients.all()
+            }
+            if ingredient_ids & pantry:
+                expected[recipe.id] = len(ingredient_ids - pantry)
+        self.assertEqual(
+            {recipe['id']: recipe['missing'] for recipe in results},
+            expected
+        )
+        missing = [recipe['missing'] for recipe in results]
+        self.assertEqual(missing, sorted(missing))
+        self.assertEqual(missing[0], 0)
+
+
+class RecipeImageUpdateTest(ApiTestCase):
+    """Variants are rebuilt only when an update brings another image."""
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media(self)
+        self.recipe = Recipe.objects.filter(author=self.authors[0]).first()
+        self.variants = {'webp': {'320': 'recipes/variants/test-320.webp'}}
+        self.recipe.image_variants = self.variants
+        self.recipe.save(update_fields=['image_variants'])
+        self.author_client = token_client(self.authors[0])
+        for name in ('schedule_recipe_image', 'release_recipe_image'):
+            patcher = mock.patch(f'api.serializers.{name}')
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_same_image(self):
+        # validate() wants an image on every request, so update() is
+        # called with data that keeps the stored one.
+        RecipeWriteSerializer().update(self.recipe, {
+            'tags': list(self.recipe.tags.all()),
+            'ingredients': [
+                {'id': row.ingredient_id, 'amount': row.amount}
+                for row in self.recipe.recipeingredient_set.all()
+            ],
+            'name': 'Суп'
+        })
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, 'recipes/test.png')
+        self.assertEqual(self.recipe.image_variants, self.variants)
+        self.schedule_recipe_image.assert_not_called()
+        self.release_recipe_image.assert_not_called()
+
+    def test_new_image(self):
+        response = self.author_client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': 10}
+                    for ingredient in self.recipe.ingredients.all()
+                ],
+                'tags': [self.tags[0].id],
+                'image': png_data_uri('red'),
+                'name': 'Суп',
+                'text': 'Текст',
+                'cooking_time': 5
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        self.assertNotEqual(self.recipe.image.name, 'recipes/test.png')
+        self.assertEqual(self.recipe.image_variants, {})
+        self.release_recipe_image.assert_called_once_with('recipes/test.png')
+        self.schedule_recipe_image.assert_called_once()
+
+
+class CartTotalsTest(ApiTestCase):
+    """The shopping list follows cart and recipe changes made anywhere."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = list(Recipe.objects.order_by('id')[:3])
+        for recipe in self.recipes:
+            response = self.client.post(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, 201)
+
+    def assertShoppingList(self, recipes):
+        expected = Counter()
+        for recipe in recipes:
+            for name, amount in recipe.recipeingredient_set.values_list(
+                    'ingredient__name', 'amount'):
+                expected[name] += amount
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?type=json'
+        )
+        self.assertEqual(
+            {
+                row['name']: row['amount']
+                for row in json.loads(b''.join(response.streaming_content))
+            },
+            dict(expected)
+        )
+        call_command('cart_totals', '--verify', stdout=io.StringIO())
+
+    def test_api(self):
+        self.assertShoppingList(self.recipes)
+        self.client.delete(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertShoppingList(self.recipes[1:])
+
+    def test_recipe_deleted(self):
+        Recipe.objects.get(id=self.recipes[0].id).delete()
+        self.assertShoppingList(self.recipes[1:])
+        Recipe.objects.filter(id=self.recipes[1].id).delete()
+        self.assertShoppingList(self.recipes[2:])
+
+    def test_author_deleted(self):
+        self.recipes[0].author.delete()
+        self.assertShoppingList(self.recipes[1:])
+
+    def test_cart_deleted(self):
+        Cart.objects.get(owner=self.user, recipe=self.recipes[1]).delete()
+        self.assertShoppingList(self.recipes[::2])
+
+    def test_recipe_ingredients_saved(self):
+        row = self.recipes[0].recipeingredient_set.first()
+        row.amount = 25
+        row.save()
+        self.assertShoppingList(self.recipes)
+        row.recipe = self.recipes[2]
+        row.ingredient = self.ingredients[-1]
+        row.save()
+        self.assertShoppingList(self.recipes)
+        RecipeIngredient.objects.create(
+            recipe=self.recipes[1],
+            ingredient=self.ingredients[-2],
+            amount=3
+        )
+        self.assertShoppingList(self.recipes)
+        row.delete()
+        self.assertShoppingList(self.recipes)
+
+    def test_recipe_updated(self):
+        use_temp_media(self)
+        recipe = self.recipes[0]
+        ingredients = list(recipe.ingredients.all())
+        response = token_client(recipe.author).patch(
+            f'/api/recipes/{recipe.id}/',
+            {
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': 7}
+                    for ingredient in ingredients[1:] + self.ingredients[-2:]
+                ],
+                'tags': [self.tags[0].id],
+                'image': png_data_uri('red'),
+                'name': 'Суп',
+                'text': 'Текст',
+                'cooking_time': 5
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertShoppingList(self.recipes)
+
+
+@override_settings(
+    QUERY_INSTRUMENTATION=True,
+    QUERY_BUDGET_STRICT=True,
+    FEED_FANOUT_BACKEND='sync',
+    RECIPE_IMAGE_BACKEND='thread'
+)
+class QueryBudgetTest(FixtureMixin, TransactionTestCase):
+    """Every budgeted action stays within its view's query_budget.
+
+    Over budget the middleware raises QueryBudgetExceeded. Transactions
+    really commit here, so on_commit work is counted as in production.
+    """
+
+    def setUp(self):
+        use_temp_media(self)
+        # Image variants are built outside the request, so not run at all;
+        # the in-memory indexes are keyed by ContentVersion, which starts
+        # over with every test here.
+        for patcher in (
+            mock.patch('recipes.images.get_executor'),
+            mock.patch('api.views.recipe_match_index', RecipeMatchIndex()),
+            mock.patch('recipes.search.ingredient_index', IngredientIndex()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        caches['recipes'].clear()
+        self.create_fixture()
+        self.client = token_client(self.user)
+
+    def request(self, method, url, data=None, status=200, client=None):
+        response = getattr(client or self.client, method)(
+            url, data, format='json'
+        )
+        self.assertEqual(response.status_code, status, url)
+        if response.streaming:
+            # Its queries run, and are counted, as the content is read.
+            b''.join(response.streaming_content)
+        return response
+
+    def recipe_payload(self, ingredients, image_color=None):
+        payload = {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 5}
+                for ingredient in ingredients
+            ],
+            'tags': [tag.id for tag in self.tags],
+            'name': 'Суп',
+            'text': 'Текст',
+            'cooking_time': 15,
+        }
+        if image_color is not None:
+            payload['image'] = png_data_uri(image_color)
+        return payload
+
+    def test_recipe_actions(self):
+        other = token_client(self.authors[0])
+        recipe_id = self.request(
+            'post',
+            '/api/recipes/',
+            self.recipe_payload(self.ingredients[:4], 'red'),
+            201
+        ).data['id']
+        url = f'/api/recipes/{recipe_id}/'
+        self.request('get', '/api/recipes/')
+        self.request('get', url)
+        for client in (self.client, other):
+            self.request('post', f'{url}shopping_cart/', status=201,
+                         client=client)
+        self.request('post', f'{url}favorite/', status=201)
+        self.request(
+            'patch',
+            url,
+            self.recipe_payload(self.ingredients[2:7], 'green')
+        )
+        self.request(
+            'put', url, self.recipe_payload(self.ingredients[5:9], 'blue')
+        )
+        self.request('get', '/api/recipes/download_shopping_cart/')
+        ingredient_ids = ','.join(
+            str(ingredient.id) for ingredient in self.ingredients[:5]
+        )
+        self.request(
+            'get', f'/api/recipes/match/?ingredients={ingredient_ids}'
+        )
+        self.request('get', f'{url}similar/')
+        self.request('delete', f'{url}favorite/', status=204)
+        self.request('delete', url, status=204)
+
+    def test_user_actions(self):
+        author = self.authors[2]
+        self.request('get', '/api/users/')
+        self.request('get', f'/api/users/{author.id}/')
+        self.request('get', '/api/users/me/')
+        self.request('post', f'/api/users/{author.id}/subscribe/', status=201)
+        self.request('get', '/api/users/subscriptions/?recipes_limit=2')
+        self.request('get', '/api/users/feed/')
+        self.request(
+            'delete', f'/api/users/{author.id}/subscribe/', status=204
+        )
+
+    def test_reference_actions(self):
+        self.request('get', '/api/tags/')
+        self.request('get', f'/api/tags/{self.tags[0].id}/')
+        self.request('get', '/api/ingredients/')
+        self.request('get', '/api/ingredients/?name=ингр')
+        self.request('get', f'/api/ingredients/{self.ingredients[0].id}/')
+
+
+@override_settings(QUERY_INSTRUMENTATION=True)
+class QueryWrapperTest(TransactionTestCase):
+    """Request profiles come off connections opened during the request."""
+
+    def test_connection_opened_in_request(self):
+        # Middleware is loaded here, the thread's connection opens during
+        # its first request, as in a threaded worker.
+        client = APIClient()
+        client.get('/api/tags/')
+        wrappers = []
+
+        def request():
+            try:
+                client.get('/api/tags/')
+                wrappers.extend(connections['default'].execute_wrappers)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+        self.assertEqual(wrappers, [count_query])
@@ -1,37 +1,115 @@
+from django.db import connection
+from django.db.models.signals import post_save
+from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
 from rest_framework import status
 from rest_framework.response import Response
 
-from recipes.models import Recipe
+from recipes.models import Cart, Favorite, Recipe
+from users.models import Subscribe
+
+
+class Viewer:
+    """Relationships of the requesting user, loaded once per request."""
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, model, owner_field, field):
+        if self.user.is_anonymous:
+            return frozenset()
+        return frozenset(model.objects.filter(
+            **{owner_field: self.user}
+        ).values_list(field, flat=True))
+
+    @cached_property
+    def favorite_ids(self):
+        return self._ids(Favorite, 'owner', 'recipe_id')
+
+    @cached_property
+    def cart_ids(self):
+        return self._ids(Cart, 'owner', 'recipe_id')
+
+    @cached_property
+    def following_ids(self):
+        return self._ids(Subscribe, 'user', 'following_id')
+
+
+class ViewerContextMixin:
+
+    @cached_property
+    def viewer(self):
+        return Viewer(self.request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['viewer'] = self.viewer
+        return context
+
+
+def insert_if_absent(model, **values):
+    """INSERT ... ON CONFLICT DO NOTHING, True if a row was inserted.
+
+    Sends post_save for an inserted row, as save() would.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(model._meta.get_field(name).column) for name in values
+    )
+    placeholders = ', '.join(['%s'] * len(values))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+            f'VALUES ({placeholders}) ON CONFLICT DO NOTHING',
+            list(values.values())
+        )
+        inserted = cursor.rowcount == 1
+    if inserted:
+        post_save.send(
+            sender=model,
+            instance=model(**{
+                model._meta.get_field(name).attname: value
+                for name, value in values.items()
+            }),
+            created=True
+        )
+    return inserted
 
 
 class FavoriteCartMixin:
 
     def make_response(self, request, model, serializer, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
         if request.method == 'POST':
-            if model.objects.filter(
-                    owner=request.user,
-                    recipe=recipe
-            ).exists():
-                return Response(
-                    {'errors': 'Этот объект уже есть!'},
-                    status.HTTP_400_BAD_REQUEST
-                )
-            serializer = serializer(
-                data=request.data,
-                context={'request': request}
+            recipe = get_object_or_404(
+                Recipe.objects.only('id', 'name', 'image', 'cooking_time'),
+                id=pk
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save(owner=request.user, recipe=recipe)
-            return Response(serializer.data, status.HTTP_201_CREATED)
-        cart = model.objects.filter(
-            owner=request.user,
-            recipe=recipe
-        )
-        if cart.exists():
-            cart.delete()
-            return Response(status.HTTP_204_NO_CONTENT)
+            with atomic():
+                if not insert_if_absent(
+                        model,
+                        owner=request.user.id,
+                        recipe=recipe.id
+                ):
+                    return Response(
+                        {'errors': 'Этот объект уже есть!'},
+                        status.HTTP_400_BAD_REQUEST
+                    )
+            return Response(
+                serializer(
+                    model(owner=request.user, recipe=recipe),
+                    context={'request': request}
+                ).data,
+                status.HTTP_201_CREATED
+            )
+        with atomic():
+            deleted, _ = model.objects.filter(
+                owner=request.user,
+                recipe_id=pk
+            ).delete()
+        if deleted:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(Recipe, id=pk)
         return Response(
             {'errors': 'Этого объекта не было!'},
             status.HTTP_400_BAD_REQUEST
@@ -1,32 +1,79 @@
-import io
-
-from django.db.models import Sum
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Count, F, Prefetch, prefetch_related_objects
+from django.db.models.functions import Greatest
+from django.db.transaction import atomic
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import FileResponse
+from django.http import Http404, StreamingHttpResponse
 from djoser.serializers import SetPasswordSerializer
 from rest_framework import viewsets, status, permissions
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from . import serializers, filters
+from . import serializers, filters, shopping_list
+from .caching import (
+    conditional_response,
+    overlay_viewer,
+    recipe_feed_cache,
+    recipe_feed_key
+)
 from .permissions import IsAuthorAdminOrReadPermission
-from .pagination import PageLimitPagination
-from .utils import FavoriteCartMixin
-from recipes import models
+from .pagination import (
+    FeedCursorPagination,
+    PageLimitPagination,
+    PageNumberLimitPagination
+)
+from .utils import (
+    FavoriteCartMixin,
+    Viewer,
+    ViewerContextMixin,
+    insert_if_absent
+)
+from foodgram.metrics import cache_lookup, count_export
+from recipes import models, timeline
+from recipes.images import release_recipe_image
+from recipes.matching import recipe_match_index
+from recipes.search import search_ingredients
 from users.models import CustomUser, Subscribe
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ViewerContextMixin, viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     permission_classes = (permissions.AllowAny,)
     pagination_class = PageLimitPagination
+    query_budget = {
+        'list': 4,
+        'retrieve': 4,
+        'me': 1,
+        'subscriptions': 4,
+        'subscribe': 9,
+        'delete_subscribe': 7,
+        'feed': 10,
+    }
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return serializers.UserSerializer
+        if self.action == 'feed':
+            return serializers.RecipeReadSerializer
         return serializers.UserCreateSerializer
 
+    def get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is None:
+            return settings.SUBSCRIPTION_RECIPES_MAX_LIMIT
+        try:
+            recipes_limit = int(recipes_limit)
+        except ValueError:
+            recipes_limit = 0
+        if recipes_limit < 1:
+            raise ValidationError(
+                {'recipes_limit': 'Должно быть целым положительным числом!'}
+            )
+        return min(recipes_limit, settings.SUBSCRIPTION_RECIPES_MAX_LIMIT)
+
     @action(
         methods=['post'],
         detail=False,
@@ -59,29 +106,50 @@ class UserViewSet(viewsets.ModelViewSet):
         url_path='subscribe',
         permission_classes=(permissions.IsAuthenticated,)
     )
+    @atomic
     def subscribe(self, request, pk):
         user = get_object_or_404(CustomUser, id=pk)
+        if user == request.user:
+            return Response(
+                {'errors': 'Вы не можете подписаться на себя!'},
+                status.HTTP_400_BAD_REQUEST
+            )
+        if not insert_if_absent(
+                Subscribe,
+                user=request.user.id,
+                following=user.id
+        ):
+            return Response(
+                {'errors': 'Вы уже подписаны на этого пользователя!'},
+                status.HTTP_400_BAD_REQUEST
+            )
+        CustomUser.objects.filter(id=user.id).update(
+            followers_count=F('followers_count') + 1
+        )
+        timeline.schedule(timeline.backfill, user.id, request.user.id)
         serializer = serializers.SubscribeSerializer(
-            data=request.data,
+            Subscribe(user=request.user, following=user),
             context={
                 'request': request,
-                'following': user
+                'recipes_limit': self.get_recipes_limit()
             }
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user, following=user)
         return Response(serializer.data, status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
+    @atomic
     def delete_subscribe(self, request, pk):
-        user = get_object_or_404(CustomUser, id=pk)
-        subscribe = Subscribe.objects.filter(
+        deleted, _ = Subscribe.objects.filter(
             user=request.user,
-            following=user
-        )
-        if subscribe.exists():
-            subscribe.delete()
+            following_id=pk
+        ).delete()
+        if deleted:
+            CustomUser.objects.filter(id=pk).update(
+                followers_count=Greatest(F('followers_count') - 1, 0)
+            )
+            timeline.unfollowed(request.user.id, pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(CustomUser, id=pk)
         return Response(
             {'error': 'Вы не подписаны на этого пользователя!'},
             status.HTTP_400_BAD_REQUEST
@@ -94,44 +162,252 @@ class UserViewSet(viewsets.ModelViewSet):
         permission_classes=(permissions.IsAuthenticated,)
     )
     def subscriptions(self, request):
+        recipes_limit = self.get_recipes_limit()
         queryset = Subscribe.objects.filter(
             user=request.user
-        )
+        ).select_related(
+            'following'
+        ).annotate(
+            recipes_count=Count('following__recipes')
+        ).order_by('-id')
         subscribes = self.paginate_queryset(queryset)
+        recipes = models.Recipe.objects.defer('search_vector').order_by('-id')
+        if recipes_limit:
+            recipes = recipes.latest_per_author(
+                [subscribe.following_id for subscribe in subscribes],
+                recipes_limit
+            )
+        prefetch_related_objects(
+            subscribes,
+            Prefetch('following__recipes', queryset=recipes)
+        )
         serializer = serializers.SubscribeSerializer(
             subscribes,
             many=True,
-            context={'request': request}
+            context={
+                **self.get_serializer_context(),
+                'recipes_limit': recipes_limit
+            }
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path='feed',
+        permission_classes=(permissions.IsAuthenticated,),
+        pagination_class=FeedCursorPagination
+    )
+    def feed(self, request):
+        """Recipes of the followed authors, newest first."""
+        recipe_ids = self.paginator.candidate_ids(
+            request,
+            timeline.followed_sources(request.user.id)
+        )
+        page = self.paginate_queryset(
+            models.Recipe.objects.with_related().filter(id__in=recipe_ids)
         )
+        serializer = self.get_serializer(page, many=True)
         return self.get_paginated_response(serializer.data)
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class VersionedReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+    """Reference data answered with 304 until its ContentVersion changes.
+
+    ``content_version`` is the version the ETag was made from, for
+    renderers that serve data cached per version.
+    """
+    version_name = None
+    query_budget = {'list': 3, 'retrieve': 3}
+    content_version = None
+
+    def conditional(self, request, render):
+        self.content_version, = models.ContentVersion.objects.get_versions(
+            self.version_name
+        )
+        return conditional_response(
+            request,
+            render,
+            f'{self.version_name}-{self.content_version}'
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(
+            request,
+            lambda: self.render_list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            request,
+            lambda: super(VersionedReadOnlyViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+    def render_list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class IngredientsViewSet(VersionedReadOnlyViewSet):
     queryset = models.Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
     permission_classes = (permissions.AllowAny,)
-    filter_backends = (filters.IngredientSearchFilter,)
-    search_fields = ('^name',)
+    version_name = 'ingredient'
+
+    def render_list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return super().render_list(request, *args, **kwargs)
+        try:
+            limit = int(request.query_params.get(
+                'limit',
+                settings.INGREDIENT_SEARCH_LIMIT
+            ))
+        except ValueError:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        limit = max(1, min(limit, settings.INGREDIENT_SEARCH_MAX_LIMIT))
+        serializer = self.get_serializer(
+            search_ingredients(name, limit, self.content_version),
+            many=True
+        )
+        return Response(serializer.data)
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class TagsViewSet(VersionedReadOnlyViewSet):
     queryset = models.Tag.objects.all()
     serializer_class = serializers.TagSerializer
     permission_classes = (permissions.AllowAny,)
+    version_name = 'tag'
 
 
-class RecipeViewSet(viewsets.ModelViewSet, FavoriteCartMixin):
+class RecipeViewSet(
+    ViewerContextMixin,
+    viewsets.ModelViewSet,
+    FavoriteCartMixin
+):
     queryset = models.Recipe.objects.all()
     permission_classes = (IsAuthorAdminOrReadPermission,)
     pagination_class = PageLimitPagination
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, filters.RecipeOrderingFilter)
     filterset_class = filters.RecipeFilterSet
+    query_budget = {
+        'list': 10,
+        'retrieve': 9,
+        'create': 18,
+        'update': 28,
+        'partial_update': 28,
+        'destroy': 21,
+        'favorite': 5,
+        'shopping_cart': 6,
+        'download_shopping_cart': 2,
+        'match': 12,
+        'similar': 3,
+    }
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return models.Recipe.objects.with_related().order_by('-id')
+        return super().get_queryset().defer('search_vector')
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
             return serializers.RecipeReadSerializer
+        if self.action == 'match':
+            return serializers.RecipeMatchSerializer
         return serializers.RecipeWriteSerializer
 
+    def get_pantry(self):
+        """Ingredient ids of ?ingredients=1,2&ingredients=3."""
+        try:
+            ingredient_ids = {
+                int(value)
+                for values in self.request.query_params.getlist('ingredients')
+                for value in values.split(',') if value.strip()
+            }
+        except ValueError:
+            ingredient_ids = None
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Передайте id ингредиентов через запятую!'}
+            )
+        if len(ingredient_ids) > settings.RECIPE_MATCH_MAX_INGREDIENTS:
+            raise ValidationError({'ingredients': (
+                'Не больше '
+                f'{settings.RECIPE_MATCH_MAX_INGREDIENTS} ингредиентов!'
+            )})
+        return ingredient_ids
+
+    def get_max_missing(self):
+        max_missing = self.request.query_params.get(
+            'max_missing',
+            settings.RECIPE_MATCH_MAX_MISSING
+        )
+        try:
+            max_missing = int(max_missing)
+        except ValueError:
+            max_missing = -1
+        if max_missing < 0:
+            raise ValidationError(
+                {'max_missing': 'Должно быть целым неотрицательным числом!'}
+            )
+        return min(max_missing, settings.RECIPE_MATCH_MAX_MISSING)
+
+    def list(self, request, *args, **kwargs):
+        key = recipe_feed_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        cache = recipe_feed_cache()
+        data = cache.get(key)
+        cache_lookup('recipe_feed', data is not None)
+        if data is None:
+            page = self.paginate_queryset(
+                self.filter_queryset(self.get_queryset())
+            )
+            serializer = self.get_serializer(
+                page,
+                many=True,
+                context={
+                    **self.get_serializer_context(),
+                    'viewer': Viewer(AnonymousUser())
+                }
+            )
+            data = self.get_paginated_response(serializer.data).data
+            cache.set(key, data)
+        if request.user.is_authenticated:
+            data = overlay_viewer(data, self.viewer)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = get_object_or_404(
+            models.Recipe.objects.values('id', 'author_id', 'modified'),
+            pk=kwargs['pk']
+        )
+        tag_version, ingredient_version = (
+            models.ContentVersion.objects.get_versions('tag', 'ingredient')
+        )
+        flags = ''.join(str(int(flag)) for flag in (
+            recipe['id'] in self.viewer.favorite_ids,
+            recipe['id'] in self.viewer.cart_ids,
+            recipe['author_id'] in self.viewer.following_ids
+        ))
+        modified = recipe['modified'].timestamp()
+        return conditional_response(
+            request,
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs
+            ),
+            f'recipe-{recipe["id"]}-{modified:.6f}-'
+            f'{tag_version}-{ingredient_version}-{flags}',
+            None if request.user.is_authenticated else int(modified),
+            cache_control='recipe'
+        )
+
+    @atomic
+    def perform_destroy(self, instance):
+        release_recipe_image(instance.image.name)
+        instance.delete()
+
     @action(
         methods=['post', 'delete'],
         detail=True,
@@ -160,6 +436,49 @@ class RecipeViewSet(viewsets.ModelViewSet, FavoriteCartMixin):
             pk
         )
 
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path='match',
+        pagination_class=PageNumberLimitPagination
+    )
+    def match(self, request):
+        """Recipes by how few ingredients they lack from ?ingredients=."""
+        page = self.paginate_queryset(recipe_match_index.match(
+            self.get_pantry(),
+            self.get_max_missing()
+        ))
+        recipes = models.Recipe.objects.with_related().in_bulk(
+            [recipe_id for recipe_id, _ in page]
+        )
+        found = []
+        for recipe_id, missing in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.missing = missing
+                found.append(recipe)
+        serializer = self.get_serializer(found, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'], detail=True, url_path='similar')
+    def similar(self, request, pk):
+        """Neighbours precomputed by the similar_recipes command."""
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+        recipes = list(models.Recipe.objects.defer('search_vector').filter(
+            similar_to__recipe_id=pk
+        ).order_by('similar_to__rank'))
+        if not recipes:
+            get_object_or_404(models.Recipe.objects.only('id'), pk=pk)
+        serializer = serializers.RecipeShortSerializer(
+            recipes,
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
     @action(
         methods=['get'],
         detail=False,
@@ -167,23 +486,25 @@ class RecipeViewSet(viewsets.ModelViewSet, FavoriteCartMixin):
         permission_classes=[permissions.IsAuthenticated]
     )
     def download_shopping_cart(self, request):
-        shopping_list = models.RecipeIngredient.objects.filter(
-            recipe__cart_recipe__owner=request.user
-        ).values(
-            'ingredient'
-        ).annotate(
-            total_amount=Sum('amount')
+        file_type = request.query_params.get('type', 'txt')
+        if file_type not in shopping_list.RENDERERS:
+            return Response(
+                {'errors': 'Неподдерживаемый формат файла!'},
+                status.HTTP_400_BAD_REQUEST
+            )
+        content_type, renderer = shopping_list.RENDERERS[file_type]
+        rows = models.CartIngredient.objects.filter(
+            owner=request.user
         ).values_list(
             'ingredient__name',
-            'total_amount',
-            'ingredient__measurement_unit')
-        ingredients = []
-        for ingredient in shopping_list:
-            ingredients.append('{0} - {1} {2}.'.format(
-                *ingredient
-            ))
-        text = '\n'.join(ingredients)
-        buffer = io.BytesIO()
-        buffer.write(bytes(text, 'utf-8'))
-        buffer.seek(0)
-        return FileResponse(buffer, as_attachment=True, filename='ShoppingList.txt')
+            'amount',
+            'ingredient__measurement_unit'
+        ).order_by('ingredient__name').iterator()
+        response = StreamingHttpResponse(
+            count_export(shopping_list.stream(renderer, rows), file_type),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="ShoppingList.{file_type}"'
+        )
+        return response
@@ -0,0 +1,88 @@
+"""PostgreSQL backend that takes its connections from a ConnectionPool.
+
+Django opens a connection on the first query of a request and, with
+CONN_MAX_AGE = 0, closes it when the request ends; here "open" checks one
+out of the process-wide pool of the database alias and "close" gives it
+back, rolled back if a transaction was left open.
+"""
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from .pool import ConnectionPool, PoolTimeout
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias):
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = ConnectionPool(
+                    alias,
+                    settings.DB_POOL_SIZE,
+                    settings.DB_POOL_TIMEOUT
+                )
+    return pool
+
+
+def is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except base.Database.Error:
+        return False
+    return True
+
+
+def is_reusable(connection):
+    """Roll back a transaction left open; broken connections are dropped."""
+    if connection.closed:
+        return False
+    if (connection.get_transaction_status()
+            != extensions.TRANSACTION_STATUS_IDLE):
+        try:
+            connection.rollback()
+        except base.Database.Error:
+            return False
+    return (connection.get_transaction_status()
+            == extensions.TRANSACTION_STATUS_IDLE)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Django sets isolation_level on the wrapper while connecting; it only
+    # depends on OPTIONS, so reused connections take the one of the first.
+    isolation_levels = {}
+
+    def _connect(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        self.isolation_levels[self.alias] = self.isolation_level
+        return connection
+
+    def get_new_connection(self, conn_params):
+        check = None
+        if self.settings_dict.get('CONN_HEALTH_CHECKS'):
+            check = is_usable
+        try:
+            connection = get_pool(self.alias).acquire(
+                partial(self._connect, conn_params),
+                check
+            )
+        except PoolTimeout as error:
+            raise base.Database.OperationalError(str(error)) from error
+        self.isolation_level = self.isolation_levels[self.alias]
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.alias).release(
+                    self.connection,
+                    is_reusable(self.connection)
+                )
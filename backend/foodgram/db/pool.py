@@ -0,0 +1,85 @@
+import threading
+import time
+
+from foodgram.metrics import (
+    DB_POOL_CONNECTIONS, DB_POOL_SIZE, DB_POOL_TIMEOUTS, DB_POOL_WAIT
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """At most ``size`` connections shared by the threads of one process.
+
+    Idle connections are handed out most recently used first; when all
+    ``size`` are checked out, acquire() waits up to ``timeout`` seconds for
+    one to come back.
+    """
+
+    def __init__(self, name, size, timeout):
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        DB_POOL_SIZE.labels(name).inc(size)
+        self._idle_gauge = DB_POOL_CONNECTIONS.labels(name, 'idle')
+        self._in_use_gauge = DB_POOL_CONNECTIONS.labels(name, 'in_use')
+        self._wait = DB_POOL_WAIT.labels(name)
+
+    def acquire(self, connect, check=None):
+        """An idle connection that passes ``check``, or a new one."""
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            DB_POOL_TIMEOUTS.labels(self.name).inc()
+            raise PoolTimeout(
+                f'All {self.size} connections of the {self.name} pool are '
+                f'busy, waited {self.timeout}s.'
+            )
+        self._wait.observe(time.perf_counter() - started)
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    connection = connect()
+                    break
+                self._idle_gauge.dec()
+                if check is None or check(connection):
+                    break
+                self.discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._in_use_gauge.inc()
+        return connection
+
+    def release(self, connection, reuse=True):
+        self._in_use_gauge.dec()
+        try:
+            if reuse:
+                with self._lock:
+                    self._idle.append(connection)
+                self._idle_gauge.inc()
+            else:
+                self.discard(connection)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close the idle connections; checked out ones are not touched."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._idle_gauge.dec()
+            self.discard(connection)
@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+    Histogram, generate_latest, multiprocess
+)
+
+from api.instrumentation import when_sent
+
+# Under gunicorn PROMETHEUS_MULTIPROC_DIR is set and every worker writes its
+# samples to mmap'ed files there; /metrics merges the files of all workers.
+
+REQUEST_LATENCY = Histogram(
+    'foodgram_request_duration_seconds',
+    'Request latency by view action.',
+    ('route', 'method')
+)
+REQUESTS = Counter(
+    'foodgram_requests',
+    'Requests by view action and status class.',
+    ('route', 'method', 'status')
+)
+ERRORS = Counter(
+    'foodgram_request_errors',
+    'Requests answered with a 5xx status.',
+    ('route', 'method')
+)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries',
+    'SQL queries per request.',
+    ('route', 'method'),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, float('inf'))
+)
+DB_TIME = Histogram(
+    'foodgram_db_duration_seconds',
+    'Time spent in SQL per request.',
+    ('route', 'method'),
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, float('inf'))
+)
+CACHE_REQUESTS = Counter(
+    'foodgram_cache_requests',
+    'Cache lookups by cache and result.',
+    ('cache', 'result')
+)
+EXPORT_BYTES = Histogram(
+    'foodgram_shopping_list_bytes',
+    'Size of downloaded shopping lists.',
+    ('format',),
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, float('inf'))
+)
+
+# Built-in connection pool (DB_POOL_SIZE). Gauges are summed over live
+# workers, so in_use / size is the utilisation of the whole deployment.
+DB_POOL_SIZE = Gauge(
+    'foodgram_db_pool_size',
+    'Connections the pool may open.',
+    ('database',),
+    multiprocess_mode='livesum'
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'foodgram_db_pool_connections',
+    'Open pool connections by state.',
+    ('database', 'state'),
+    multiprocess_mode='livesum'
+)
+DB_POOL_WAIT = Histogram(
+    'foodgram_db_pool_wait_seconds',
+    'Time spent waiting for a free pool connection.',
+    ('database',),
+    buckets=(.0005, .001, .005, .01, .05, .1, .5, 1, 5, float('inf'))
+)
+DB_POOL_TIMEOUTS = Counter(
+    'foodgram_db_pool_timeouts',
+    'Checkouts that gave up after DB_POOL_TIMEOUT.',
+    ('database',)
+)
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def count_export(chunks, file_type):
+    """Pass the streamed chunks through and record the total size."""
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        EXPORT_BYTES.labels(file_type).observe(size)
+
+
+_current = threading.local()
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+def count_query(execute, sql, params, many, context):
+    # Installed once per connection rather than per request: entering
+    # connection.execute_wrapper() costs more than the whole observation.
+    counter = getattr(_current, 'queries', None)
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.duration += time.perf_counter() - started
+        counter.count += 1
+
+
+def install_query_counter(connection):
+    # First in the list, under any per-request wrapper: a connection may
+    # open in the middle of a request, after such a wrapper was pushed.
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_query)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install_query_counter(connection)
+
+
+class MetricsMiddleware:
+    """Per-route latency, status, error and DB metrics.
+
+    Routes are named after the DRF viewset action (``RecipeViewSet.list``),
+    other views after their URL name, so the label set stays small. The
+    labelled children are looked up once per route and kept.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.series = {}
+        for connection in connections.all():
+            install_query_counter(connection)
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = _current.queries = QueryCounter()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            _current.queries = None
+            raise
+
+        def observe():
+            _current.queries = None
+            self.observe(request, response, queries, started)
+
+        # Streaming responses run their queries as they are sent.
+        when_sent(response, observe)
+        return response
+
+    def observe(self, request, response, queries, started):
+        duration = time.perf_counter() - started
+        route = getattr(request, 'metrics_route', 'unmatched')
+        key = (route, request.method, response.status_code // 100)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = self.make_series(*key)
+        latency, requests, errors, db_queries, db_time = series
+        latency.observe(duration)
+        requests.inc()
+        if errors is not None:
+            errors.inc()
+        db_queries.observe(queries.count)
+        db_time.observe(queries.duration)
+
+    @staticmethod
+    def make_series(route, method, status):
+        return (
+            REQUEST_LATENCY.labels(route, method),
+            REQUESTS.labels(route, method, f'{status}xx'),
+            ERRORS.labels(route, method) if status == 5 else None,
+            DB_QUERIES.labels(route, method),
+            DB_TIME.labels(route, method),
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', None)
+        actions = getattr(view_func, 'actions', None)
+        if actions:
+            request.metrics_route = (
+                f'{view.__name__}.{actions.get(request.method.lower())}'
+            )
+        elif view is not None:
+            request.metrics_route = view.__name__
+        else:
+            request.metrics_route = request.resolver_match.view_name
+        return None
+
+
+def metrics_view(request):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry),
+        content_type=CONTENT_TYPE_LATEST
+    )
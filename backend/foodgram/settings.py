@@ -37,6 +37,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "foodgram.metrics.MetricsMiddleware",
+    "api.instrumentation.QueryInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -74,10 +76,49 @@ DATABASES = {
         "USER": os.getenv("POSTGRES_USER"),
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("DB_HOST"),
-        "PORT": os.getenv("DB_PORT")
+        "PORT": os.getenv("DB_PORT"),
+        # Seconds a connection is kept for the next requests of the worker.
+        "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", 60)),
+        # Ping a kept connection before reusing it in a new request.
+        "CONN_HEALTH_CHECKS": (
+            os.getenv("DB_CONN_HEALTH_CHECKS", "True") == "True"
+        ),
     }
 }
 
+# Built-in connection pool for PostgreSQL without PgBouncer: up to
+# DB_POOL_SIZE connections per process, checked out for one request and
+# waited for at most DB_POOL_TIMEOUT seconds. 0 turns the pool off.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 0))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+if DB_POOL_SIZE and DATABASES["default"]["ENGINE"] in (
+        "django.db.backends.postgresql",
+        "django.db.backends.postgresql_psycopg2"):
+    DATABASES["default"]["ENGINE"] = "foodgram.db"
+    # The pool keeps the connections; give them back after every request.
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recipes': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipes',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+if os.getenv('REDIS_URL'):
+    CACHES['recipes'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'TIMEOUT': 300,
+    }
+
+RECIPE_FEED_CACHE = 'recipes'
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -104,6 +145,92 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    # orjson is used when installed, the stdlib json module otherwise.
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+INGREDIENT_SEARCH_IN_MEMORY = (
+    os.getenv('INGREDIENT_SEARCH_IN_MEMORY', 'True') == 'True'
+)
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_MAX_LIMIT = 100
+
+# Recipes per author in subscriptions: the most ?recipes_limit= may ask
+# for, and the number shown without it.
+SUBSCRIPTION_RECIPES_MAX_LIMIT = 50
+
+# Text search configuration of Recipe.search_vector on PostgreSQL.
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+RECIPE_SEARCH_FALLBACK_LIMIT = 500
+
+# "Cook with what I have": /api/recipes/match/?ingredients=1,2,3
+RECIPE_MATCH_MAX_INGREDIENTS = 100
+RECIPE_MATCH_MAX_MISSING = 5
+# Seconds of Recipe.modified re-read on every sync of the in-memory index.
+RECIPE_MATCH_SYNC_OVERLAP = int(os.getenv('RECIPE_MATCH_SYNC_OVERLAP', 60))
+# Share of dead or changed positions that triggers a full rebuild.
+RECIPE_MATCH_REBUILD_RATIO = 0.25
+# Neighbours per recipe stored by the similar_recipes command.
+RECIPE_SIMILAR_COUNT = 10
+
+# /api/users/feed/: recipes of authors with up to FEED_FANOUT_MAX_FOLLOWERS
+# followers are copied into follower timelines, the rest are read on demand.
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 1000))
+# Recipes of an author added to a timeline on follow and on rebuild.
+FEED_BACKFILL_RECIPES = 50
+# 'thread' runs fan-out on a background pool, 'sync' right after commit.
+FEED_FANOUT_BACKEND = os.getenv('FEED_FANOUT_BACKEND', 'thread')
+FEED_FANOUT_WORKERS = int(os.getenv('FEED_FANOUT_WORKERS', 1))
+
+RECIPE_IMAGE_MAX_BYTES = int(os.getenv('RECIPE_IMAGE_MAX_BYTES', 5 * 1024 * 1024))
+RECIPE_IMAGE_VARIANT_WIDTHS = (320, 640, 1280)
+RECIPE_IMAGE_VARIANT_QUALITY = 80
+# 'thread' builds variants on a background pool, 'sync' inside the request.
+RECIPE_IMAGE_BACKEND = os.getenv('RECIPE_IMAGE_BACKEND', 'thread')
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
+API_CACHE_CONTROL = {
+    'reference': os.getenv('API_CACHE_CONTROL_REFERENCE', 'max-age=300'),
+    'recipe': os.getenv('API_CACHE_CONTROL_RECIPE', 'no-cache'),
+}
+
+# Server-Timing and per-request query logging, on by default with
+# DEBUG=True.
+QUERY_INSTRUMENTATION = (
+    os.getenv('QUERY_INSTRUMENTATION', DEBUG or 'False') == 'True'
+)
+# Log query shapes repeated QUERY_REPEAT_THRESHOLD times (N+1 patterns).
+QUERY_REPEAT_DETECTION = (
+    os.getenv('QUERY_REPEAT_DETECTION', DEBUG or 'False') == 'True'
+)
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', 3))
+# Raise instead of logging when a view goes over its query_budget.
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+
+# Prometheus metrics at /metrics; see gunicorn.conf.py for multi-process.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.queries': {
+            'handlers': ['console'],
+            'level': os.getenv('QUERY_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
 }
 
 DJOSER = {
@@ -0,0 +1,23 @@
+import os
+import shutil
+
+# Every worker thread holds its own database connection; see the sizing
+# notes in infra/docker-compose.yml before raising these.
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+# prometheus_client keeps the samples of every worker in
+# PROMETHEUS_MULTIPROC_DIR; start each run with an empty directory.
+
+
+def on_starting(server):
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
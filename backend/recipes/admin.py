@@ -26,19 +26,11 @@ class Recipe(admin.ModelAdmin):
         'carts_count'
     )
     list_filter = ('author', 'tags')
+    readonly_fields = ('favorites_count', 'carts_count')
 
     def recipe_image(self, object):
         return mark_safe(f"<img src='{object.image.url}' width=100>")
 
-    def count_recipes(self, model, object):
-        return model.objects.filter(recipe=object).count()
-
-    def favorites_count(self, object):
-        return self.count_recipes(models.Favorite, object)
-
-    def carts_count(self, object):
-        return self.count_recipes(models.Favorite, object)
-
 
 admin.site.register(models.Tag, TagAdmin)
 admin.site.register(models.Ingredient, IngredientAdmin)
@@ -0,0 +1,123 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import ContentVersion, Recipe
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def variant_formats():
+    Image.init()
+    formats = ['webp']
+    if 'AVIF' in Image.SAVE:
+        formats.append('avif')
+    return formats
+
+
+def variant_path(image_name, width, image_format):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'recipes/variants/{stem}-{width}.{image_format}'
+
+
+def build_variants(image_name):
+    """Resize the stored original into width variants, return their paths."""
+    with Recipe.image.field.storage.open(image_name) as file:
+        original = Image.open(file)
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA')
+    variants = {}
+    for image_format in variant_formats():
+        variants[image_format] = {}
+        for width in settings.RECIPE_IMAGE_VARIANT_WIDTHS:
+            if width > original.width and variants[image_format]:
+                break
+            path = variant_path(image_name, width, image_format)
+            if default_storage.exists(path):
+                variants[image_format][str(width)] = path
+                continue
+            image = original.copy()
+            image.thumbnail((width, width * original.height // original.width))
+            buffer = io.BytesIO()
+            image.save(
+                buffer,
+                image_format.upper(),
+                quality=settings.RECIPE_IMAGE_VARIANT_QUALITY
+            )
+            variants[image_format][str(width)] = default_storage.save(
+                path,
+                ContentFile(buffer.getvalue())
+            )
+    return variants
+
+
+def process_recipe_image(recipe_id, image_name):
+    try:
+        variants = build_variants(image_name)
+        updated = Recipe.objects.filter(
+            pk=recipe_id,
+            image=image_name
+        ).update(image_variants=variants, modified=timezone.now())
+        if updated:
+            ContentVersion.objects.bump('recipe')
+        else:
+            # The image was replaced while its variants were being built.
+            release_recipe_image(image_name)
+    except Exception:
+        logger.exception('Could not build variants for %s', image_name)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-images'
+        )
+    return _executor
+
+
+def schedule_recipe_image(recipe):
+    """Build variants for the recipe image once the transaction commits."""
+    recipe_id, image_name = recipe.pk, recipe.image.name
+
+    def submit():
+        if settings.RECIPE_IMAGE_BACKEND == 'sync':
+            process_recipe_image(recipe_id, image_name)
+        else:
+            get_executor().submit(process_recipe_image, recipe_id, image_name)
+
+    transaction.on_commit(submit)
+
+
+def release_recipe_image(image_name):
+    """Delete an image and its variants once no recipe references it.
+
+    Variant paths are derived from the image name rather than read from
+    Recipe.image_variants, which is still empty while they are being built.
+    """
+
+    def release():
+        if not image_name or Recipe.objects.filter(image=image_name).exists():
+            return
+        Recipe.image.field.storage.delete(image_name)
+        for image_format in variant_formats():
+            for width in settings.RECIPE_IMAGE_VARIANT_WIDTHS:
+                default_storage.delete(
+                    variant_path(image_name, width, image_format)
+                )
+
+    transaction.on_commit(release)
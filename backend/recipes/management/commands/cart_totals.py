@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import CartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the per-user shopping cart ingredient totals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare stored totals with the live aggregate, change nothing.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            CartIngredient.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt {CartIngredient.objects.count()} cart totals.'
+            ))
+            return
+        live = CartIngredient.objects.live_totals()
+        stored = dict(
+            ((owner_id, ingredient_id), amount)
+            for owner_id, ingredient_id, amount
+            in CartIngredient.objects.values_list(
+                'owner_id', 'ingredient_id', 'amount'
+            ).iterator()
+        )
+        mismatched = [
+            key for key in live.keys() | stored.keys()
+            if live.get(key) != stored.get(key)
+        ]
+        for owner_id, ingredient_id in mismatched[:20]:
+            self.stdout.write(
+                f'owner={owner_id} ingredient={ingredient_id}: '
+                f'stored={stored.get((owner_id, ingredient_id))} '
+                f'live={live.get((owner_id, ingredient_id))}'
+            )
+        if mismatched:
+            raise CommandError(f'{len(mismatched)} cart totals are out of date.')
+        self.stdout.write(self.style.SUCCESS('Cart totals are up to date.'))
@@ -0,0 +1,59 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Delete recipe images and variants no recipe references.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list the files that would be deleted.'
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Keep files modified less than this many minutes ago.'
+        )
+
+    def walk(self, storage, directory):
+        directories, files = storage.listdir(directory)
+        for name in files:
+            yield os.path.join(directory, name)
+        for name in directories:
+            yield from self.walk(storage, os.path.join(directory, name))
+
+    def handle(self, *args, **options):
+        storage = Recipe.image.field.storage
+        referenced = set()
+        for image, variants in Recipe.objects.values_list(
+                'image', 'image_variants'
+        ).iterator():
+            referenced.add(image)
+            for widths in variants.values():
+                referenced.update(widths.values())
+        threshold = timezone.now() - timedelta(minutes=options['min_age'])
+        deleted = 0
+        if not storage.exists('recipes'):
+            return
+        for name in self.walk(storage, 'recipes'):
+            if name in referenced:
+                continue
+            if storage.get_modified_time(name) > threshold:
+                continue
+            deleted += 1
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                storage.delete(name)
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {deleted} unreferenced files.'
+        ))
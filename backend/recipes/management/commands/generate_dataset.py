@@ -0,0 +1,231 @@
+import io
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from PIL import Image
+
+from recipes import timeline
+from recipes.models import (
+    Cart, CartIngredient, ContentVersion, Favorite, Ingredient, Recipe,
+    RecipeIngredient, Tag
+)
+from recipes.storage import image_storage
+from users.models import CustomUser, Subscribe
+
+DEFAULT_TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+WORDS = (
+    'суп', 'салат', 'пирог', 'каша', 'рагу', 'запеканка', 'омлет', 'паста',
+    'жаркое', 'блины', 'котлеты', 'плов', 'борщ', 'сырники', 'гуляш',
+)
+TEXT = 'Смешать ингредиенты, довести до готовности и подать к столу. '
+
+
+def zipf_weights(count, exponent=1.1):
+    """Weights of a Zipf-like popularity curve: a few items get most hits."""
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+def sample_distinct(rng, population, weights, count):
+    """``count`` distinct items, drawn with the given popularity weights."""
+    count = min(count, len(population))
+    chosen = set()
+    while len(chosen) < count:
+        chosen.update(rng.choices(population, weights, k=count - len(chosen)))
+    return chosen
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a reproducible synthetic dataset: users, recipes, '
+        'follows, favorites and carts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=5000,
+            help='Total recipes, spread over authors with a Zipf curve.'
+        )
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Average subscriptions per user.')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Average favorites per user.')
+        parser.add_argument('--carts', type=int, default=3,
+                            help='Average shopping cart recipes per user.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix',
+            default='synthetic',
+            help='Username/email prefix of the generated users.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Rows per INSERT statement.'
+        )
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                'No ingredients, run load_ingredients first.'
+            )
+        prefix = options['prefix']
+        if CustomUser.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Users with prefix "{prefix}" already exist, '
+                f'pass another --prefix.'
+            )
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Popularity is a property of the item, not of its id order.
+        self.rng.shuffle(ingredient_ids)
+        started = time.monotonic()
+        with transaction.atomic():
+            tag_ids = self.tags()
+            user_ids = self.users(prefix, options['users'])
+            recipes = self.recipes(
+                user_ids, options['recipes'], tag_ids, ingredient_ids
+            )
+            self.relations(user_ids, recipes, options)
+            generated = Recipe.objects.filter(author_id__in=user_ids)
+            generated.refresh_counters()
+            # bulk_create sends no post_save, so fill search_vector here.
+            if connection.vendor == 'postgresql':
+                generated.update_search_vectors()
+            CartIngredient.objects.rebuild()
+            CustomUser.objects.refresh_followers_count()
+            timeline.rebuild()
+            for name in ('recipe', 'tag'):
+                ContentVersion.objects.bump(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_ids)} users and {len(recipes)} recipes '
+            f'in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def insert(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.stdout.write(f'{model.__name__}: {len(objects)} rows')
+
+    def tags(self):
+        if not Tag.objects.exists():
+            self.insert(Tag, [
+                Tag(name=name, color=color, slug=slug)
+                for name, color, slug in DEFAULT_TAGS
+            ])
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def users(self, prefix, count):
+        password = make_password('password')
+        self.insert(CustomUser, [
+            CustomUser(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                first_name='Пользователь',
+                last_name=str(number),
+                password=password
+            )
+            for number in range(count)
+        ])
+        return list(CustomUser.objects.filter(
+            username__startswith=prefix
+        ).order_by('id').values_list('id', flat=True))
+
+    def placeholder_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), '#E26C2D').save(buffer, 'JPEG')
+        return image_storage().save(
+            'recipes/placeholder.jpg',
+            ContentFile(buffer.getvalue())
+        )
+
+    def recipes(self, user_ids, count, tag_ids, ingredient_ids):
+        rng = self.rng
+        image = self.placeholder_image()
+        authors = rng.choices(user_ids, zipf_weights(len(user_ids)), k=count)
+        self.insert(Recipe, [
+            Recipe(
+                author_id=author_id,
+                name=f'{rng.choice(WORDS).capitalize()} №{number}',
+                text=TEXT * rng.randint(1, 5),
+                cooking_time=rng.randint(5, 180),
+                image=image
+            )
+            for number, author_id in enumerate(authors)
+        ])
+        recipes = list(Recipe.objects.filter(
+            author_id__in=user_ids
+        ).order_by('id').values_list('id', 'author_id'))
+        ingredient_weights = zipf_weights(len(ingredient_ids))
+        tagged = []
+        amounts = []
+        for recipe_id, _ in recipes:
+            for tag_id in rng.sample(tag_ids, rng.randint(1, len(tag_ids))):
+                tagged.append(Recipe.tags.through(
+                    recipe_id=recipe_id,
+                    tag_id=tag_id
+                ))
+            size = max(1, round(rng.triangular(2, 25, 7)))
+            for ingredient_id in sample_distinct(
+                    rng, ingredient_ids, ingredient_weights, size):
+                amounts.append(RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rng.choice((1, 2, 5, 10, 50, 100, 200, 500))
+                ))
+        self.insert(Recipe.tags.through, tagged)
+        self.insert(RecipeIngredient, amounts)
+        return recipes
+
+    def relations(self, user_ids, recipes, options):
+        rng = self.rng
+        recipe_ids = [recipe_id for recipe_id, _ in recipes]
+        recipe_weights = zipf_weights(len(recipe_ids))
+        rng.shuffle(recipe_ids)
+        author_weight = dict.fromkeys(user_ids, 0)
+        for _, author_id in recipes:
+            author_weight[author_id] += 1
+        authors = [user_id for user_id in user_ids if author_weight[user_id]]
+        # Prolific authors attract more followers.
+        author_weights = [author_weight[user_id] for user_id in authors]
+        subscriptions = []
+        favorites = []
+        carts = []
+        for user_id in user_ids:
+            following = sample_distinct(
+                rng, authors, author_weights,
+                rng.randint(0, 2 * options['follows'])
+            )
+            following.discard(user_id)
+            subscriptions.extend(
+                Subscribe(user_id=user_id, following_id=author_id)
+                for author_id in following
+            )
+            favorites.extend(
+                Favorite(owner_id=user_id, recipe_id=recipe_id)
+                for recipe_id in sample_distinct(
+                    rng, recipe_ids, recipe_weights,
+                    rng.randint(0, 2 * options['favorites'])
+                )
+            )
+            carts.extend(
+                Cart(owner_id=user_id, recipe_id=recipe_id)
+                for recipe_id in sample_distinct(
+                    rng, recipe_ids, recipe_weights,
+                    rng.randint(0, 2 * options['carts'])
+                )
+            )
+        self.insert(Subscribe, subscriptions)
+        self.insert(Favorite, favorites)
+        self.insert(Cart, carts)
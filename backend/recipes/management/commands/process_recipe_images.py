@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Build resized image variants for recipes that have none.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild variants for every recipe.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        count = 0
+        for recipe_id, image_name in recipes.values_list(
+                'id', 'image'
+        ).iterator():
+            process_recipe_image(recipe_id, image_name)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {count} recipe images.'
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes import timeline
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount followers and refill the feed timelines of all users from '
+        'Subscribe and Recipe.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--per-author',
+            type=int,
+            default=settings.FEED_BACKFILL_RECIPES,
+            help='Latest recipes of every followed author to keep.'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        CustomUser.objects.refresh_followers_count()
+        entries = timeline.rebuild(options['per_author'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt timelines with {entries} entries in '
+            f'{time.monotonic() - started:.1f}s.'
+        ))
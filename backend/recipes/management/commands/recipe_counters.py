@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Recount or verify the favorites_count/carts_count of recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Compare stored counters with the live counts, change nothing.'
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            updated = Recipe.objects.refresh_counters()
+            self.stdout.write(self.style.SUCCESS(
+                f'Recounted favorites and carts of {updated} recipes.'
+            ))
+            return
+        rows = Recipe.objects.annotate(
+            live_favorites=Count('favorite_recipe', distinct=True),
+            live_carts=Count('cart_recipe', distinct=True)
+        ).values_list(
+            'id', 'favorites_count', 'live_favorites',
+            'carts_count', 'live_carts'
+        ).order_by('id')
+        mismatched = [
+            row for row in rows.iterator()
+            if row[1] != row[2] or row[3] != row[4]
+        ]
+        for recipe_id, favorites, live_favorites, carts, live_carts in (
+                mismatched[:20]):
+            self.stdout.write(
+                f'recipe={recipe_id}: '
+                f'favorites stored={favorites} live={live_favorites}, '
+                f'carts stored={carts} live={live_carts}'
+            )
+        if mismatched:
+            raise CommandError(
+                f'{len(mismatched)} recipe counters are out of date.'
+            )
+        self.stdout.write(self.style.SUCCESS('Recipe counters are up to date.'))
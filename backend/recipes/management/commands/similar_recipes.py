@@ -0,0 +1,64 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import SimilarRecipe
+from recipes.similarity import FeatureMatrix
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the most similar recipes of every recipe (Jaccard over '
+        'ingredients and tags) into SimilarRecipe. Rows are replaced chunk '
+        'by chunk, so readers never see a recipe without neighbours.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=settings.RECIPE_SIMILAR_COUNT,
+            help='Neighbours kept per recipe.'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        matrix = FeatureMatrix()
+        self.stdout.write(
+            f'Loaded {len(matrix)} recipes, {len(matrix.columns)} '
+            f'ingredients and tags in {time.perf_counter() - started:.1f}s.'
+        )
+        count, chunk_size = options['count'], options['chunk_size']
+        written = 0
+        for start in range(0, len(matrix), chunk_size):
+            rows = []
+            recipe_ids = list(matrix.ids[start:start + chunk_size])
+            for position, recipe_id in enumerate(recipe_ids, start):
+                rows += [
+                    SimilarRecipe(
+                        recipe_id=recipe_id,
+                        similar_id=similar_id,
+                        rank=rank,
+                        score=score
+                    )
+                    for rank, (similar_id, score) in enumerate(
+                        matrix.neighbours(position, count)
+                    )
+                ]
+            with transaction.atomic():
+                SimilarRecipe.objects.filter(
+                    recipe_id__in=recipe_ids
+                ).delete()
+                SimilarRecipe.objects.bulk_create(rows, batch_size=5000)
+            written += len(rows)
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'{start + len(recipe_ids)}/{len(matrix)} recipes'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} neighbours of {len(matrix)} recipes in '
+            f'{time.perf_counter() - started:.1f}s.'
+        ))
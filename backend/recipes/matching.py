@@ -0,0 +1,358 @@
+"""In-memory ingredient -> recipe bitsets for "cook with what I have".
+
+Every recipe gets a bit position, in order of Recipe.modified. An
+ingredient posting is a Python int with the bits of the recipes using it
+(an ``array`` of positions while it is sparser than N/32, which is
+smaller). A query adds the pantry postings up as bit-sliced counters, so
+the work is a few dozen big-int operations whatever the catalogue size.
+
+Edited recipes are appended at the end under a new position and their
+old bit is cleared from ``alive``; the index is rebuilt from scratch once
+dead positions pass RECIPE_MATCH_REBUILD_RATIO.
+"""
+import threading
+from array import array
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from foodgram.metrics import cache_lookup
+
+from .models import ContentVersion, Recipe, RecipeIngredient
+
+
+def bits_of(positions):
+    """Int with the bits at ``positions`` set."""
+    if not positions:
+        return 0
+    buffer = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+if hasattr(int, 'bit_count'):
+    bit_count = int.bit_count
+else:
+    def bit_count(bits):
+        return bin(bits).count('1')
+
+
+def top_positions(bits, skip, take):
+    """Positions of the set bits, highest first, after skipping ``skip``."""
+    while bits and take:
+        position = bits.bit_length() - 1
+        bits ^= 1 << position
+        if skip:
+            skip -= 1
+        else:
+            take -= 1
+            yield position
+
+
+class BitCounter:
+    """Per-bit counts over a stream of bitsets, stored bit-sliced.
+
+    ``levels[n]`` holds bit ``n`` of every counter, so adding a bitset is
+    a ripple-carry over a few ints instead of a loop over its bits.
+    """
+
+    def __init__(self):
+        self.levels = []
+        self.any = 0
+        self._equal = {}
+
+    @property
+    def most(self):
+        return (1 << len(self.levels)) - 1
+
+    def add(self, bits):
+        if not bits:
+            return
+        self.any |= bits
+        self._equal.clear()
+        carry = bits
+        for level, counter in enumerate(self.levels):
+            self.levels[level], carry = counter ^ carry, counter & carry
+            if not carry:
+                break
+        if carry:
+            self.levels.append(carry)
+
+    def equal(self, count):
+        """Bits whose counter is exactly ``count``, zero counters excluded."""
+        if count > self.most:
+            return 0
+        if count not in self._equal:
+            bits = self.any
+            for level, counter in enumerate(self.levels):
+                bits &= counter if count >> level & 1 else ~counter
+            self._equal[count] = bits
+        return self._equal[count]
+
+
+class MatchState:
+    """Positions, postings and size classes of the indexed recipes.
+
+    A state is not changed once RecipeMatchIndex has published it: sync()
+    applies changes to a copy(), so requests reading it in other threads
+    always see a consistent snapshot.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.modified = array('d')
+        self.positions = {}
+        self.postings = {}
+        self.sizes = {}
+        self.alive = 0
+        self.dead = 0
+        self.synced_at = None
+
+    def copy(self):
+        state = MatchState()
+        state.ids = array('q', self.ids)
+        state.modified = array('d', self.modified)
+        state.positions = dict(self.positions)
+        state.postings = {
+            ingredient_id: (
+                posting if isinstance(posting, int) else array('i', posting)
+            )
+            for ingredient_id, posting in self.postings.items()
+        }
+        state.sizes = dict(self.sizes)
+        state.alive = self.alive
+        state.dead = self.dead
+        state.synced_at = self.synced_at
+        return state
+
+    def add(self, recipe_id, modified, ingredient_ids):
+        """Append a recipe; a previous position of it becomes dead."""
+        old = self.positions.get(recipe_id)
+        if old is not None:
+            self.alive &= ~(1 << old)
+            self.dead += 1
+        position = len(self.ids)
+        self.ids.append(recipe_id)
+        self.modified.append(modified)
+        self.positions[recipe_id] = position
+        bit = 1 << position
+        self.alive |= bit
+        for ingredient_id in ingredient_ids:
+            posting = self.postings.get(ingredient_id)
+            if posting is None:
+                self.postings[ingredient_id] = array('i', (position,))
+            elif isinstance(posting, int):
+                self.postings[ingredient_id] = posting | bit
+            else:
+                posting.append(position)
+        size = len(ingredient_ids)
+        self.sizes[size] = self.sizes.get(size, 0) | bit
+
+    def remove(self, recipe_id):
+        position = self.positions.pop(recipe_id)
+        self.alive &= ~(1 << position)
+        self.dead += 1
+
+    def compact(self):
+        """Turn postings denser than N/32 into bitsets."""
+        threshold = len(self.ids) // 32
+        for ingredient_id, posting in self.postings.items():
+            if not isinstance(posting, int) and len(posting) > threshold:
+                self.postings[ingredient_id] = bits_of(posting)
+
+    def posting(self, ingredient_id):
+        posting = self.postings.get(ingredient_id, 0)
+        return posting if isinstance(posting, int) else bits_of(posting)
+
+    def memory(self):
+        """Rough size of the index in bytes."""
+        total = self.ids.itemsize * len(self.ids) * 2
+        total += 100 * len(self.positions)
+        for posting in self.postings.values():
+            total += (
+                (posting.bit_length() + 7) // 8
+                if isinstance(posting, int)
+                else posting.itemsize * len(posting)
+            )
+        for bits in (self.alive, *self.sizes.values()):
+            total += (bits.bit_length() + 7) // 8
+        return total
+
+
+class RecipeMatches:
+    """Lazy sequence of (recipe_id, missing) pairs, fewest missing first.
+
+    Within the same number of missing ingredients recipes come most
+    recently modified first. Sliced by the paginator, so only the
+    requested page is decoded.
+    """
+
+    def __init__(self, ids, levels):
+        self.ids = ids
+        self.levels = levels
+        self.total = sum(count for _, _, count in levels)
+
+    def __len__(self):
+        return self.total
+
+    def count(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(self.total)
+        found = []
+        for missing, bits, count in self.levels:
+            if start >= count:
+                start -= count
+                stop -= count
+                continue
+            if stop <= 0:
+                break
+            found += [
+                (self.ids[position], missing)
+                for position in top_positions(
+                    bits, start, min(stop, count) - start
+                )
+            ]
+            start, stop = 0, stop - count
+        return found
+
+
+class RecipeMatchIndex:
+    """Per-process ingredient -> recipe bitsets, kept in step with the DB.
+
+    A change of the 'recipe' ContentVersion re-reads recipes modified since
+    the last sync (minus RECIPE_MATCH_SYNC_OVERLAP for transactions that
+    committed late) and the ids of deleted ones. A change of the
+    'ingredient' version rebuilds the whole index: deleting an ingredient
+    drops rows from recipes without touching Recipe.modified.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        self._state = None
+
+    def build(self):
+        state = MatchState()
+        state.synced_at = timezone.now()
+        ingredients = {}
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id').iterator():
+            ingredients.setdefault(recipe_id, []).append(ingredient_id)
+        postings = {}
+        sizes = {}
+        for recipe_id, modified in Recipe.objects.order_by(
+                'modified', 'id').values_list('id', 'modified').iterator():
+            position = len(state.ids)
+            state.ids.append(recipe_id)
+            state.modified.append(modified.timestamp())
+            state.positions[recipe_id] = position
+            recipe_ingredients = ingredients.get(recipe_id, ())
+            for ingredient_id in recipe_ingredients:
+                postings.setdefault(ingredient_id, []).append(position)
+            sizes.setdefault(len(recipe_ingredients), []).append(position)
+        state.alive = (1 << len(state.ids)) - 1
+        state.postings = {
+            ingredient_id: array('i', positions)
+            for ingredient_id, positions in postings.items()
+        }
+        state.sizes = {
+            size: bits_of(positions) for size, positions in sizes.items()
+        }
+        state.compact()
+        return state
+
+    def sync(self, state):
+        """Apply changes made since the last sync to an unpublished state.
+
+        Returns False when so many recipes changed that a rebuild is
+        cheaper.
+        """
+        since = state.synced_at - timedelta(
+            seconds=settings.RECIPE_MATCH_SYNC_OVERLAP
+        )
+        state.synced_at = timezone.now()
+        changed = {
+            recipe_id: modified.timestamp()
+            for recipe_id, modified in Recipe.objects.filter(
+                modified__gte=since
+            ).values_list('id', 'modified')
+        }
+        changed = {
+            recipe_id: modified
+            for recipe_id, modified in changed.items()
+            if recipe_id not in state.positions
+            or state.modified[state.positions[recipe_id]] != modified
+        }
+        limit = len(state.ids) * settings.RECIPE_MATCH_REBUILD_RATIO
+        if len(changed) + state.dead > limit:
+            return False
+        if changed:
+            ingredients = {}
+            for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                    recipe_id__in=changed).values_list(
+                    'recipe_id', 'ingredient_id'):
+                ingredients.setdefault(recipe_id, []).append(ingredient_id)
+            for recipe_id, modified in sorted(
+                    changed.items(), key=lambda item: (item[1], item[0])):
+                state.add(recipe_id, modified, ingredients.get(recipe_id, ()))
+        if Recipe.objects.count() != len(state.positions):
+            for recipe_id in state.positions.keys() - set(
+                    Recipe.objects.values_list('id', flat=True).iterator()):
+                state.remove(recipe_id)
+        return True
+
+    def _load(self):
+        versions = ContentVersion.objects.get_versions('recipe', 'ingredient')
+        if versions == self._versions:
+            cache_lookup('recipe_match_index', True)
+            return self._state
+        with self._lock:
+            cache_lookup('recipe_match_index', versions == self._versions)
+            if versions != self._versions:
+                state = self._state
+                if state is not None and versions[1] == self._versions[1]:
+                    state = state.copy()
+                    if not self.sync(state):
+                        state = None
+                if state is None:
+                    state = self.build()
+                self._state = state
+                self._versions = versions
+            return self._state
+
+    def stats(self):
+        state = self._load()
+        return {
+            'recipes': len(state.positions),
+            'ingredients': len(state.postings),
+            'dead': state.dead,
+            'memory_bytes': state.memory(),
+        }
+
+    def match(self, ingredient_ids, max_missing):
+        """Recipes sharing an ingredient with the pantry, missing at most
+        ``max_missing`` of their own, as a RecipeMatches sequence.
+        """
+        state = self._load()
+        alive, sizes = state.alive, state.sizes
+        matched = BitCounter()
+        for ingredient_id in set(ingredient_ids):
+            matched.add(state.posting(ingredient_id) & alive)
+        levels = []
+        for missing in range(max_missing + 1):
+            bits = 0
+            for size, recipes in sizes.items():
+                if size > missing:
+                    bits |= recipes & matched.equal(size - missing)
+            if bits:
+                levels.append((missing, bits, bit_count(bits)))
+        return RecipeMatches(state.ids, levels)
+
+
+recipe_match_index = RecipeMatchIndex()
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.1 on 2026-10-17 06:09
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_cart_ingredients(apps, schema_editor):
+    Cart = apps.get_model('recipes', 'Cart')
+    CartIngredient = apps.get_model('recipes', 'CartIngredient')
+    totals = Cart.objects.values(
+        'owner_id',
+        'recipe__recipeingredient__ingredient_id'
+    ).annotate(
+        total=Sum('recipe__recipeingredient__amount')
+    ).filter(total__isnull=False)
+    CartIngredient.objects.bulk_create(
+        (
+            CartIngredient(
+                owner_id=row['owner_id'],
+                ingredient_id=row['recipe__recipeingredient__ingredient_id'],
+                amount=row['total']
+            )
+            for row in totals.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0004_alter_tag_color'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField()),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipes.ingredient')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='cartingredient',
+            constraint=models.UniqueConstraint(fields=('owner', 'ingredient'), name='unique_cart_ingredient'),
+        ),
+        migrations.RunPython(fill_cart_ingredients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.1 on 2026-10-17 06:17
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=recipes.storage.image_storage, upload_to='recipes/'),
+        ),
+    ]
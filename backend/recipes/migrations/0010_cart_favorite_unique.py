@@ -0,0 +1,70 @@
+# Generated by Django 4.2.1 on 2026-10-17 06:18
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def remove_duplicates(apps, schema_editor):
+    for model_name in ('Cart', 'Favorite'):
+        model = apps.get_model('recipes', model_name)
+        duplicates = model.objects.values('owner', 'recipe').annotate(
+            keep=Min('id'),
+            count=Count('id')
+        ).filter(count__gt=1)
+        removed = 0
+        for row in duplicates.iterator():
+            removed += model.objects.filter(
+                owner=row['owner'],
+                recipe=row['recipe']
+            ).exclude(id=row['keep']).delete()[0]
+        if model_name == 'Cart' and removed:
+            rebuild_cart_ingredients(apps)
+
+
+def rebuild_cart_ingredients(apps):
+    Cart = apps.get_model('recipes', 'Cart')
+    CartIngredient = apps.get_model('recipes', 'CartIngredient')
+    CartIngredient.objects.all().delete()
+    totals = Cart.objects.values(
+        'owner_id',
+        'recipe__recipeingredient__ingredient_id'
+    ).annotate(
+        total=Sum('recipe__recipeingredient__amount')
+    ).filter(total__isnull=False)
+    CartIngredient.objects.bulk_create(
+        (
+            CartIngredient(
+                owner_id=row['owner_id'],
+                ingredient_id=row['recipe__recipeingredient__ingredient_id'],
+                amount=row['total']
+            )
+            for row in totals.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('owner', 'recipe'), name='unique_cart'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('owner', 'recipe'), name='unique_favorite'),
+        ),
+        # Covers tags__slug filtering: tag -> (tag_id, recipe_id) without
+        # touching the table, the default indexes lead with recipe_id.
+        migrations.RunSQL(
+            'CREATE INDEX recipe_tags_tag_recipe_idx '
+            'ON recipes_recipe_tags (tag_id, recipe_id)',
+            'DROP INDEX recipe_tags_tag_recipe_idx'
+        ),
+    ]
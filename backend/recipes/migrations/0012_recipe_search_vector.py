@@ -0,0 +1,51 @@
+# Generated by Django 4.2.1 on 2026-10-17 06:34
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+    schema_editor.execute(
+        '''
+        UPDATE recipes_recipe AS recipe SET search_vector =
+            setweight(to_tsvector(%(config)s::regconfig, recipe.name), 'A')
+            || setweight(to_tsvector(%(config)s::regconfig, recipe.text), 'B')
+            || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+                SELECT string_agg(ingredient.name, ' ')
+                FROM recipes_recipeingredient AS amount
+                JOIN recipes_ingredient AS ingredient
+                    ON ingredient.id = amount.ingredient_id
+                WHERE amount.recipe_id = recipe.id
+            ), '')), 'C')
+        ''',
+        {'config': settings.RECIPE_SEARCH_CONFIG}
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-17 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['modified'], name='recipe_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:37
+
+from django.db import migrations
+
+
+def create_lower_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_trgm_idx')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ingredient_name_lower_prefix_idx '
+        'ON recipes_ingredient (lower(name) text_pattern_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ingredient_name_lower_trgm_idx '
+        'ON recipes_ingredient USING gin (lower(name) gin_trgm_ops)'
+    )
+
+
+def drop_lower_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_lower_prefix_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS ingredient_name_lower_trgm_idx')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS ingredient_name_trgm_idx '
+        'ON recipes_ingredient USING gin (name gin_trgm_ops)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_timelineentry'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ingredient',
+            name='ingredient_name_prefix_idx',
+        ),
+        migrations.RunPython(
+            create_lower_name_indexes,
+            drop_lower_name_indexes
+        ),
+    ]
@@ -1,8 +1,43 @@
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator
 from colorfield.fields import ColorField
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import (
+    Count, F, OuterRef, Prefetch, Subquery, Sum, Window
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
 from users.models import CustomUser, Subscribe
+from .storage import image_storage
+
+
+class ContentVersionQuerySet(models.QuerySet):
+
+    def get_versions(self, *names):
+        versions = dict(self.filter(name__in=names).values_list(
+            'name',
+            'version'
+        ))
+        return [versions.get(name, 0) for name in names]
+
+    def bump(self, name):
+        if not self.filter(name=name).update(version=F('version') + 1):
+            self.get_or_create(name=name, defaults={'version': 1})
+
+
+class ContentVersion(models.Model):
+    """Change counter for reference data, used to build HTTP ETags."""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = ContentVersionQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.name} | {self.version}'
 
 
 class Tag(models.Model):
@@ -15,6 +50,8 @@ class Tag(models.Model):
 
 
 class Ingredient(models.Model):
+    # lower(name) prefix and trigram indexes, PostgreSQL only, are made by
+    # migration 0016.
     name = models.CharField(max_length=200)
     measurement_unit = models.CharField(max_length=200)
 
@@ -39,6 +76,67 @@ class RecipeIngredient(models.Model):
         return f'{self.recipe.name} | {self.ingredient} | {self.amount}'
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        return self.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def refresh_counters(self):
+        """Recount favorites_count and carts_count from the source rows."""
+        def counter(model):
+            return Coalesce(Subquery(
+                model.objects.filter(
+                    recipe=OuterRef('pk')
+                ).values('recipe').annotate(total=Count('id')).values('total')
+            ), 0)
+        return self.update(
+            favorites_count=counter(Favorite),
+            carts_count=counter(Cart)
+        )
+
+    def update_search_vectors(self):
+        """Recompute search_vector from name, text and ingredient names.
+
+        PostgreSQL only; elsewhere recipes.search keeps an in-memory index.
+        """
+        config = settings.RECIPE_SEARCH_CONFIG
+        ingredient_names = Subquery(
+            RecipeIngredient.objects.filter(
+                recipe=OuterRef('pk')
+            ).values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names')
+        )
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector('text', weight='B', config=config)
+            + SearchVector(ingredient_names, weight='C', config=config)
+        ))
+
+    def latest_per_author(self, author_ids, limit):
+        """Newest ``limit`` recipes of each author, ranked by ROW_NUMBER()."""
+        ranked = self.filter(author_id__in=author_ids).annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=F('id').desc()
+            )
+        ).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(id__in=RawSQL(
+            f'SELECT id FROM ({sql}) ranked WHERE row_number <= %s',
+            (*params, limit)
+        ))
+
+
 class Recipe(models.Model):
     tags = models.ManyToManyField(Tag)
     author = models.ForeignKey(
@@ -53,16 +151,102 @@ class Recipe(models.Model):
     )
     name = models.CharField(max_length=200)
     image = models.ImageField(
-        upload_to='recipes/'
+        upload_to='recipes/',
+        storage=image_storage
     )
+    image_variants = models.JSONField(default=dict, blank=True)
+    favorites_count = models.PositiveIntegerField(default=0)
+    carts_count = models.PositiveIntegerField(default=0)
     text = models.TextField()
     cooking_time = models.IntegerField(
         validators=[MinValueValidator(1)]
     )
+    modified = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_popular_idx'
+            ),
+            models.Index(fields=['modified'], name='recipe_modified_idx'),
+            models.Index(fields=['author', '-id'], name='recipe_author_idx')
+        ]
 
     def __str__(self):
         return f'{self.name} | {self.author} | {self.cooking_time}'
 
+    def ingredient_amounts(self):
+        return dict(self.recipeingredient_set.values_list(
+            'ingredient_id',
+            'amount'
+        ))
+
+    def cart_owner_ids(self):
+        return list(self.cart_recipe.values_list('owner_id', flat=True))
+
+
+class SimilarRecipe(models.Model):
+    """Precomputed nearest neighbours, written by similar_recipes."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        db_index=False
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to'
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'rank'],
+                name='unique_similar_rank'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} -> {self.similar_id} | {self.score:.3f}'
+
+
+class TimelineEntry(models.Model):
+    """A recipe in the feed of a follower of its author, see timeline.py."""
+    owner = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        db_index=False
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    author = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.owner_id} | {self.recipe_id}'
+
 
 class Cart(models.Model):
     owner = models.ForeignKey(
@@ -75,6 +259,14 @@ class Cart(models.Model):
         related_name='cart_recipe'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'recipe'],
+                name='unique_cart'
+            )
+        ]
+
     def __str__(self):
         return f'{self.owner.username} | {self.recipe.name}'
 
@@ -90,5 +282,155 @@ class Favorite(models.Model):
         related_name='favorite_recipe'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'recipe'],
+                name='unique_favorite'
+            )
+        ]
+
     def __str__(self):
         return f'{self.owner.username} | {self.recipe.name}'
+
+
+class CartIngredientQuerySet(models.QuerySet):
+
+    @transaction.atomic
+    def apply_deltas(self, deltas):
+        """Add {(owner_id, ingredient_id): amount} deltas to the totals."""
+        deltas = {key: value for key, value in deltas.items() if value}
+        if not deltas:
+            return
+        existing = {
+            (row.owner_id, row.ingredient_id): row
+            for row in self.select_for_update().filter(
+                owner_id__in={owner_id for owner_id, _ in deltas},
+                ingredient_id__in={ingredient_id for _, ingredient_id in deltas}
+            )
+        }
+        to_create, to_update, to_delete = [], [], []
+        for (owner_id, ingredient_id), delta in deltas.items():
+            row = existing.get((owner_id, ingredient_id))
+            if row is None:
+                if delta > 0:
+                    to_create.append(self.model(
+                        owner_id=owner_id,
+                        ingredient_id=ingredient_id,
+                        amount=delta
+                    ))
+                continue
+            row.amount += delta
+            if row.amount > 0:
+                to_update.append(row)
+            else:
+                to_delete.append(row.pk)
+        if to_create:
+            self.bulk_create(to_create)
+        if to_update:
+            self.bulk_update(to_update, ['amount'])
+        if to_delete:
+            self.filter(pk__in=to_delete).delete()
+
+    def add_recipe(self, owner_id, recipe_id):
+        """Add a recipe's ingredients to one owner's totals in one upsert."""
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (owner_id, ingredient_id, amount) '
+                f'SELECT %s, ingredient_id, amount '
+                f'FROM {RecipeIngredient._meta.db_table} WHERE recipe_id = %s '
+                f'ON CONFLICT (owner_id, ingredient_id) '
+                f'DO UPDATE SET amount = {table}.amount + excluded.amount',
+                [owner_id, recipe_id]
+            )
+
+    def remove_recipe(self, owner_id, recipe_id):
+        recipe_ingredients = RecipeIngredient.objects.filter(recipe_id=recipe_id)
+        totals = self.filter(owner_id=owner_id)
+        totals.filter(
+            ingredient_id__in=recipe_ingredients.values('ingredient_id')
+        ).update(amount=Greatest(
+            F('amount') - Subquery(recipe_ingredients.filter(
+                ingredient_id=OuterRef('ingredient_id')
+            ).values('amount')[:1]),
+            0
+        ))
+        totals.filter(amount=0).delete()
+
+    def remove_ingredient(self, recipe_id, ingredient_id, amount):
+        """Take one ingredient row of a recipe out of its carts' totals."""
+        totals = self.filter(
+            owner_id__in=Cart.objects.filter(
+                recipe_id=recipe_id
+            ).values('owner_id'),
+            ingredient_id=ingredient_id
+        )
+        totals.update(amount=Greatest(F('amount') - amount, 0))
+        totals.filter(amount=0).delete()
+
+    def add_amounts(self, owner_ids, amounts, sign=1):
+        self.apply_deltas({
+            (owner_id, ingredient_id): sign * amount
+            for owner_id in owner_ids
+            for ingredient_id, amount in amounts.items()
+        })
+
+    def live_totals(self):
+        return {
+            (owner_id, ingredient_id): total
+            for owner_id, ingredient_id, total in Cart.objects.values(
+                'owner_id',
+                'recipe__recipeingredient__ingredient_id'
+            ).annotate(
+                total=Sum('recipe__recipeingredient__amount')
+            ).filter(
+                total__isnull=False
+            ).values_list(
+                'owner_id',
+                'recipe__recipeingredient__ingredient_id',
+                'total'
+            ).iterator()
+        }
+
+    @transaction.atomic
+    def rebuild(self):
+        self.all().delete()
+        self.bulk_create(
+            (
+                self.model(
+                    owner_id=owner_id,
+                    ingredient_id=ingredient_id,
+                    amount=total
+                )
+                for (owner_id, ingredient_id), total
+                in self.live_totals().items()
+            ),
+            batch_size=1000
+        )
+
+
+class CartIngredient(models.Model):
+    owner = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE
+    )
+    amount = models.PositiveIntegerField()
+
+    objects = CartIngredientQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'ingredient'],
+                name='unique_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.owner.username} | {self.ingredient} | {self.amount}'
@@ -0,0 +1,198 @@
+import re
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Lower
+
+from foodgram.metrics import cache_lookup
+
+from .models import ContentVersion, Ingredient, Recipe, RecipeIngredient
+
+WORD = re.compile(r'\w+')
+# Same proportions as the default ts_rank weights of A, B and C.
+RECIPE_FIELD_WEIGHTS = {'name': 1.0, 'text': 0.4, 'ingredient': 0.2}
+
+
+class IngredientIndex:
+    """Sorted in-process copy of the ingredient catalogue for autocomplete.
+
+    Built lazily on first use and rebuilt when the ingredient content
+    version changes, so every worker answers an ETag with the same body.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+
+    def _load(self, version=None):
+        if version is None:
+            version, = ContentVersion.objects.get_versions('ingredient')
+        if version == self._version:
+            cache_lookup('ingredient_index', True)
+            return self._data
+        with self._lock:
+            cache_lookup('ingredient_index', version == self._version)
+            if version != self._version:
+                rows = sorted(
+                    (name.lower(), pk, name, measurement_unit)
+                    for pk, name, measurement_unit
+                    in Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'
+                    ).iterator()
+                )
+                self._data = ([row[0] for row in rows], rows)
+                self._version = version
+            return self._data
+
+    def search(self, query, limit, version=None):
+        """``version`` is the ingredient content version the caller read,
+        if any; the index then matches it without another query.
+        """
+        keys, rows = self._load(version)
+        found = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(rows[position])
+            position += 1
+        if len(found) < limit:
+            for key, row in zip(keys, rows):
+                if query in key and not key.startswith(query):
+                    found.append(row)
+                    if len(found) == limit:
+                        break
+        return [
+            Ingredient(id=pk, name=name, measurement_unit=measurement_unit)
+            for _, pk, name, measurement_unit in found
+        ]
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_ingredients(query, limit, version=None):
+    """Prefix matches first, then substring matches, both by name."""
+    query = query.strip().lower()
+    if not query:
+        return []
+    if settings.INGREDIENT_SEARCH_IN_MEMORY:
+        return ingredient_index.search(query, limit, version)
+    # lower(name) has a prefix and a trigram index on PostgreSQL.
+    ingredients = Ingredient.objects.annotate(
+        lower_name=Lower('name')
+    ).order_by('name')
+    found = list(ingredients.filter(lower_name__startswith=query)[:limit])
+    if len(found) < limit:
+        found += ingredients.filter(
+            lower_name__contains=query
+        ).exclude(
+            lower_name__startswith=query
+        )[:limit - len(found)]
+    return found
+
+
+class RecipeSearchIndex:
+    """In-process inverted index over recipe name, text and ingredients.
+
+    Stands in for the PostgreSQL search_vector on other databases. Every
+    query word must match the start of a word in the recipe; the score adds
+    up RECIPE_FIELD_WEIGHTS per match. Rebuilt when the recipe or
+    ingredient content version changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        self._data = None
+
+    def _load(self):
+        versions = ContentVersion.objects.get_versions('recipe', 'ingredient')
+        if versions == self._versions:
+            cache_lookup('recipe_search_index', True)
+            return self._data
+        with self._lock:
+            cache_lookup('recipe_search_index', versions == self._versions)
+            if versions != self._versions:
+                postings = {}
+
+                def add(recipe_id, text, weight):
+                    for word in WORD.findall(text.lower()):
+                        scores = postings.setdefault(word, {})
+                        scores[recipe_id] = scores.get(recipe_id, 0) + weight
+
+                for recipe_id, name, text in Recipe.objects.values_list(
+                        'id', 'name', 'text').iterator():
+                    add(recipe_id, name, RECIPE_FIELD_WEIGHTS['name'])
+                    add(recipe_id, text, RECIPE_FIELD_WEIGHTS['text'])
+                for recipe_id, name in RecipeIngredient.objects.values_list(
+                        'recipe_id', 'ingredient__name').iterator():
+                    add(recipe_id, name, RECIPE_FIELD_WEIGHTS['ingredient'])
+                self._data = (sorted(postings), postings)
+                self._versions = versions
+            return self._data
+
+    def search(self, query):
+        """Map of recipe id to score for recipes matching every word."""
+        words = WORD.findall(query.lower())
+        if not words:
+            return {}
+        keys, postings = self._load()
+        found = None
+        for word in words:
+            matched = {}
+            position = bisect_left(keys, word)
+            while position < len(keys) and keys[position].startswith(word):
+                for recipe_id, score in postings[keys[position]].items():
+                    matched[recipe_id] = matched.get(recipe_id, 0) + score
+                position += 1
+            found = matched if found is None else {
+                recipe_id: score + matched[recipe_id]
+                for recipe_id, score in found.items()
+                if recipe_id in matched
+            }
+            if not found:
+                break
+        return found
+
+
+recipe_index = RecipeSearchIndex()
+
+
+def search_recipes(queryset, query):
+    """Filter recipes by words, annotated with ``search_rank``.
+
+    PostgreSQL matches search_vector (GIN indexed) with websearch syntax;
+    other databases use the in-memory index and keep the
+    RECIPE_SEARCH_FALLBACK_LIMIT best matches.
+    """
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query,
+            config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch'
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        )
+    found = sorted(
+        recipe_index.search(query).items(),
+        key=lambda item: (-item[1], -item[0])
+    )[:settings.RECIPE_SEARCH_FALLBACK_LIMIT]
+    if not found:
+        return queryset.none().annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    return queryset.filter(
+        id__in=[recipe_id for recipe_id, _ in found]
+    ).annotate(
+        search_rank=Case(
+            *(When(id=recipe_id, then=Value(score))
+              for recipe_id, score in found),
+            output_field=FloatField()
+        )
+    )
@@ -0,0 +1,243 @@
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from .models import (
+    Cart, CartIngredient, ContentVersion, Favorite, Ingredient, Recipe,
+    RecipeIngredient, Tag
+)
+from . import timeline
+
+
+def on_commit_once(key, callback):
+    """Register ``callback`` unless one under ``key`` is already pending.
+
+    Looks at the connection's own queue, so callbacks dropped by a rollback
+    are not mistaken for pending ones. Returns the registered callback.
+    """
+    for entry in transaction.get_connection().run_on_commit:
+        if getattr(entry[1], 'on_commit_key', None) == key:
+            return entry[1]
+    callback.on_commit_key = key
+    transaction.on_commit(callback)
+    return callback
+
+
+def bump_on_commit(name):
+    """Bump a ContentVersion once per transaction, after it commits."""
+    on_commit_once(
+        ('bump', name),
+        lambda: ContentVersion.objects.bump(name)
+    )
+
+
+def refresh_search_on_commit(recipe_ids):
+    """Recompute search vectors of the recipes once the transaction ends."""
+    if connection.vendor != 'postgresql':
+        return
+
+    def refresh():
+        Recipe.objects.filter(
+            id__in=refresh.recipe_ids
+        ).update_search_vectors()
+
+    refresh.recipe_ids = set(recipe_ids)
+    on_commit_once('search', refresh).recipe_ids.update(recipe_ids)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredient_version(sender, **kwargs):
+    ContentVersion.objects.bump('ingredient')
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_recipes_search(sender, instance, created, **kwargs):
+    if not created:
+        refresh_search_on_commit(
+            instance.recipeingredient_set.values_list('recipe_id', flat=True)
+        )
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tag_version(sender, **kwargs):
+    ContentVersion.objects.bump('tag')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def bump_recipe_version(sender, **kwargs):
+    bump_on_commit('recipe')
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_search(sender, instance, **kwargs):
+    refresh_search_on_commit((instance.id,))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        timeline.schedule(timeline.fan_out, instance.id, instance.author_id)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def refresh_recipe_search_on_ingredients(sender, instance, **kwargs):
+    refresh_search_on_commit((instance.recipe_id,))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_version_on_tags(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_on_commit('recipe')
+
+
+def deleted_recipe_ids(origin):
+    """Recipes removed by the delete() call ``origin`` started.
+
+    Kept on ``origin`` itself, so it lasts as long as that one call.
+    """
+    if origin is None:
+        return set()
+    if not hasattr(origin, 'deleted_recipe_ids'):
+        origin.deleted_recipe_ids = set()
+    return origin.deleted_recipe_ids
+
+
+@receiver(pre_save, sender=Cart)
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_saved_row(sender, instance, raw=False, **kwargs):
+    """The row as it is in the database, for the post_save receivers."""
+    instance.saved_row = None
+    if instance.pk is not None and not raw:
+        instance.saved_row = sender.objects.filter(
+            pk=instance.pk
+        ).values().first()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_deleted_recipe_from_carts(sender, instance, origin=None,
+                                     **kwargs):
+    """Take a deleted recipe out of all cart totals at once.
+
+    Its Cart and RecipeIngredient rows, deleted in the same call, then
+    leave the totals alone.
+    """
+    CartIngredient.objects.add_amounts(
+        instance.cart_owner_ids(),
+        instance.ingredient_amounts(),
+        -1
+    )
+    deleted_recipe_ids(origin).add(instance.id)
+
+
+@receiver(post_save, sender=Cart)
+def add_cart_totals(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    saved = getattr(instance, 'saved_row', None)
+    if saved is not None:
+        if (saved['owner_id'], saved['recipe_id']) == (
+                instance.owner_id, instance.recipe_id):
+            return
+        CartIngredient.objects.remove_recipe(
+            saved['owner_id'],
+            saved['recipe_id']
+        )
+    CartIngredient.objects.add_recipe(instance.owner_id, instance.recipe_id)
+
+
+@receiver(post_delete, sender=Cart)
+def remove_cart_totals(sender, instance, origin=None, **kwargs):
+    # Deleted with its recipe the Cart row may outlive the recipe's
+    # ingredients or go first, see remove_deleted_recipe_from_carts.
+    if instance.recipe_id not in deleted_recipe_ids(origin):
+        CartIngredient.objects.remove_recipe(
+            instance.owner_id,
+            instance.recipe_id
+        )
+
+
+def cart_ingredient_deltas(recipe_id, ingredient_id, amount, deltas):
+    for owner_id in Cart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('owner_id', flat=True):
+        key = (owner_id, ingredient_id)
+        deltas[key] = deltas.get(key, 0) + amount
+    return deltas
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_recipe_ingredient_totals(sender, instance, raw=False, **kwargs):
+    """Recipe ingredients saved one by one, e.g. in the admin.
+
+    bulk_create and bulk_update send no signals; RecipeWriteSerializer
+    applies their deltas itself.
+    """
+    if raw:
+        return
+    deltas = {}
+    saved = getattr(instance, 'saved_row', None)
+    if saved is not None:
+        cart_ingredient_deltas(
+            saved['recipe_id'],
+            saved['ingredient_id'],
+            -saved['amount'],
+            deltas
+        )
+    cart_ingredient_deltas(
+        instance.recipe_id,
+        instance.ingredient_id,
+        instance.amount,
+        deltas
+    )
+    CartIngredient.objects.apply_deltas(deltas)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_recipe_ingredient_totals(sender, instance, origin=None, **kwargs):
+    # A delete() call that settles the totals itself marks its queryset
+    # with cart_totals_settled, see RecipeWriteSerializer.update.
+    if getattr(origin, 'cart_totals_settled', False):
+        return
+    if instance.recipe_id not in deleted_recipe_ids(origin):
+        CartIngredient.objects.remove_ingredient(
+            instance.recipe_id,
+            instance.ingredient_id,
+            instance.amount
+        )
+
+
+def bump_counter(model, recipe_id, delta):
+    field = 'carts_count' if model is Cart else 'favorites_count'
+    Recipe.objects.filter(id=recipe_id).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_save, sender=Favorite)
+def count_saved(sender, instance, raw=False, **kwargs):
+    """Keep Recipe.favorites_count and carts_count in step with the rows.
+
+    See the recipe_counters command for a full recount.
+    """
+    if raw:
+        return
+    saved = getattr(instance, 'saved_row', None)
+    if saved is not None:
+        if saved['recipe_id'] == instance.recipe_id:
+            return
+        bump_counter(sender, saved['recipe_id'], -1)
+    bump_counter(sender, instance.recipe_id, 1)
+
+
+@receiver(post_delete, sender=Cart)
+@receiver(post_delete, sender=Favorite)
+def count_deleted(sender, instance, origin=None, **kwargs):
+    if instance.recipe_id not in deleted_recipe_ids(origin):
+        bump_counter(sender, instance.recipe_id, -1)
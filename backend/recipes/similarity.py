@@ -0,0 +1,79 @@
+"""Nearest recipes by Jaccard similarity of their ingredients and tags.
+
+Recipes are rows of a sparse 0/1 matrix whose columns are ingredients and
+tags; every column is stored as a bitset over recipe positions. The
+overlap of one row with all others is a BitCounter over the row's columns,
+and since Jaccard only depends on the overlap and the other row's size,
+neighbours are read off (overlap, size) classes, best score first.
+"""
+from array import array
+
+from .matching import BitCounter, bits_of, top_positions
+from .models import Recipe, RecipeIngredient
+
+
+class FeatureMatrix:
+
+    def __init__(self):
+        self.ids = array('q', Recipe.objects.order_by('id').values_list(
+            'id', flat=True
+        ).iterator())
+        positions = {recipe_id: index for index, recipe_id in enumerate(
+            self.ids
+        )}
+        rows = [[] for _ in self.ids]
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id').iterator():
+            rows[positions[recipe_id]].append(('ingredient', ingredient_id))
+        for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag_id').iterator():
+            rows[positions[recipe_id]].append(('tag', tag_id))
+        columns = {}
+        sizes = {}
+        for position, row in enumerate(rows):
+            for column in row:
+                columns.setdefault(column, []).append(position)
+            sizes.setdefault(len(row), []).append(position)
+        self.rows = [tuple(row) for row in rows]
+        self.columns = {
+            column: bits_of(column_positions)
+            for column, column_positions in columns.items()
+        }
+        self.sizes = {
+            size: bits_of(size_positions)
+            for size, size_positions in sizes.items() if size
+        }
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def order(self, size):
+        """(score, overlap, other size) classes for a row of ``size``,
+        best Jaccard score first.
+        """
+        if size not in self._orders:
+            self._orders[size] = sorted((
+                (overlap / (size + other - overlap), overlap, other)
+                for other in self.sizes
+                for overlap in range(1, min(size, other) + 1)
+            ), reverse=True)
+        return self._orders[size]
+
+    def neighbours(self, position, count):
+        """Up to ``count`` (recipe_id, score) pairs, most similar first."""
+        row = self.rows[position]
+        overlap = BitCounter()
+        for column in row:
+            overlap.add(self.columns[column])
+        others = ~(1 << position)
+        found = []
+        for score, shared, other in self.order(len(row)):
+            bits = self.sizes[other] & overlap.equal(shared) & others
+            found += [
+                (self.ids[neighbour], score)
+                for neighbour in top_positions(bits, 0, count - len(found))
+            ]
+            if len(found) == count:
+                break
+        return found
@@ -0,0 +1,31 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Names files after the SHA-256 of their content.
+
+    The same upload is stored once, as ``<dir>/<h[:2]>/<h><ext>``. Existing
+    files are not rewritten, only touched, so the garbage collector's age
+    threshold keeps protecting files that were just referenced again.
+    """
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest[:2], f'{digest}{extension}')
+        if self.exists(name):
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
+
+
+def image_storage():
+    return ContentAddressedStorage()
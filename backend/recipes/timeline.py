@@ -0,0 +1,147 @@
+"""Per-follower recipe timelines behind /api/users/feed/.
+
+New recipes are copied into the TimelineEntry rows of the author's
+followers (fan-out on write) by a background pool, one INSERT ... SELECT
+per recipe. Authors with more than FEED_FANOUT_MAX_FOLLOWERS followers
+are skipped and their recipes are read straight from Recipe when a feed
+is requested (fan-out on read), see followed_sources().
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from users.models import CustomUser, Subscribe
+
+from .models import Recipe, TimelineEntry
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def is_fanned_out(author_id):
+    """False for authors with too many followers to copy recipes to."""
+    return CustomUser.objects.filter(
+        pk=author_id,
+        followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).exists()
+
+
+def fan_out(recipe_id, author_id):
+    """Add a recipe to the timelines of all followers of its author."""
+    if not is_fanned_out(author_id):
+        return
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (owner_id, recipe_id, author_id) '
+            f'SELECT user_id, %s, %s FROM {Subscribe._meta.db_table} '
+            f'WHERE following_id = %s ON CONFLICT DO NOTHING',
+            [recipe_id, author_id, author_id]
+        )
+
+
+def backfill(author_id, owner_id=None, limit=None):
+    """Copy the latest ``limit`` (FEED_BACKFILL_RECIPES) recipes of an
+    author into the timeline of one follower, or of all of them.
+    """
+    if not is_fanned_out(author_id):
+        return
+    table = connection.ops.quote_name(TimelineEntry._meta.db_table)
+    owners = f'{Subscribe._meta.db_table} WHERE following_id = %s'
+    params = [
+        author_id,
+        limit or settings.FEED_BACKFILL_RECIPES,
+        author_id
+    ]
+    if owner_id is not None:
+        owners += ' AND user_id = %s'
+        params.append(owner_id)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (owner_id, recipe_id, author_id) '
+            f'SELECT owner.user_id, recipe.id, recipe.author_id FROM ('
+            f'SELECT id, author_id FROM {Recipe._meta.db_table} '
+            f'WHERE author_id = %s ORDER BY id DESC LIMIT %s) AS recipe '
+            f'CROSS JOIN (SELECT user_id FROM {owners}) AS owner '
+            f'WHERE true ON CONFLICT DO NOTHING',
+            params
+        )
+
+
+def run(function, *args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Timeline update %s%r failed', function.__name__,
+                         args)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.FEED_FANOUT_WORKERS,
+            thread_name_prefix='recipe-timeline'
+        )
+    return _executor
+
+
+def schedule(function, *args):
+    """Run a timeline update once the current transaction commits."""
+
+    def submit():
+        if settings.FEED_FANOUT_BACKEND == 'sync':
+            function(*args)
+        else:
+            get_executor().submit(run, function, *args)
+
+    transaction.on_commit(submit)
+
+
+def unfollowed(owner_id, author_id):
+    """Drop an author from a timeline; if that brings the author back
+    under FEED_FANOUT_MAX_FOLLOWERS, fill their followers' timelines.
+    """
+    TimelineEntry.objects.filter(
+        owner_id=owner_id,
+        author_id=author_id
+    ).delete()
+    followers_count = CustomUser.objects.filter(
+        pk=author_id
+    ).values_list('followers_count', flat=True).first()
+    if followers_count == settings.FEED_FANOUT_MAX_FOLLOWERS:
+        schedule(backfill, author_id)
+
+
+def followed_sources(owner_id):
+    """(queryset, recipe id field) pairs whose union is the owner's feed."""
+    sources = [(TimelineEntry.objects.filter(owner_id=owner_id), 'recipe_id')]
+    read_fanned = list(Subscribe.objects.filter(
+        user_id=owner_id,
+        following__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list('following_id', flat=True))
+    if read_fanned:
+        sources.append(
+            (Recipe.objects.filter(author_id__in=read_fanned), 'id')
+        )
+    return sources
+
+
+@transaction.atomic
+def rebuild(limit=None):
+    """Refill every timeline from Subscribe and Recipe, keeping the latest
+    ``limit`` recipes of each author.
+    """
+    TimelineEntry.objects.all().delete()
+    author_ids = CustomUser.objects.filter(
+        followers_count__gt=0,
+        followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list('pk', flat=True)
+    for author_id in author_ids.iterator():
+        backfill(author_id, limit=limit)
+    return TimelineEntry.objects.count()
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.1 on 2026-10-17 06:50
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import users.models
+
+
+def fill_followers_count(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    CustomUser.objects.update(followers_count=Coalesce(Subquery(
+        Subscribe.objects.filter(
+            following=OuterRef('pk')
+        ).values('following').annotate(total=Count('id')).values('total')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_customuser_first_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='customuser',
+            managers=[
+                ('objects', users.models.CustomUserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_followers_count, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,29 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+class CustomUserManager(UserManager):
+
+    def refresh_followers_count(self):
+        """Recount followers_count from the Subscribe rows."""
+        return self.update(followers_count=Coalesce(Subquery(
+            Subscribe.objects.filter(
+                following=OuterRef('pk')
+            ).values('following').annotate(
+                total=Count('id')
+            ).values('total')
+        ), 0))
 
 
 class CustomUser(AbstractUser):
     email = models.EmailField(max_length=254, unique=True)
     first_name = models.CharField(max_length=150)
     last_name = models.CharField(max_length=150)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CustomUserManager()
 
     def __str__(self):
         return f'{self.username} | {self.first_name} {self.last_name}'
@@ -23,5 +41,13 @@ class Subscribe(models.Model):
         related_name='following'
     )
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'following'],
+                name='unique_user_subscribers'
+            )
+        ]
+
     def __str__(self):
         return f'{self.user} | {self.following}'